@@ -0,0 +1,296 @@
+"""Замеры производительности TRIAL. Запускает загрузку уровня, кадр GLevelExec, ход игрока
+с распространением сигналов и операции с предметами на уровнях из data/lvls и на сгенерированных
+уровнях разного размера, а также память и перемещение самих спрайтов (bench_sprites). Результат
+пишется в JSON, чтобы сравнивать версии между собой.
+
+    python bench.py [--sizes 16,64,256] [--repeat 20] [--out bench.json] [--replays <папка>]
+
+С --replays еще прогоняются записи ввода (*.rec, см. main.GInputLog) из папки: без окна и без
+ограничения частоты кадров, как python main.py --replay <файл>.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import re
+import random
+import shutil
+import tempfile
+import platform
+import contextlib
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")   # Окно не нужно, но изображения конвертируются как в игре
+
+import pygame as pg
+import main
+
+DEFAULT_SIZES = (16, 64, 256, 1024, 2048)
+RECEIVERS = "DdFfC"             # Клетки, которые получают сигнал
+ACTIVATORS = "B_"               # Клетки, которые его посылают
+CROWD = 2000                    # Сколько кубов разбросать по уровню для frame_render_crowd
+TWEENS = 500                    # Сколько спрайтов двигается одновременно в bench_tweens
+SPRITES = 10000                 # Сколько спрайтов создается в bench_sprites
+
+
+def generate_level(folder, rows, cols, links=4, seed=0):
+    """Создает уровень rows x cols: комнаты 8x8 с проходами, в них кнопки, нажимные плиты,
+    двери, рассеиватели и раздатчики. Каждый активатор связан с links случайными получателями,
+    так что сеть сигналов плотная, но без циклов (получатели ничего не посылают)"""
+    rnd = random.Random(seed)
+    grid = [["*"] * cols for _ in range(rows)]
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            if r % 8 == 0 or c % 8 == 0:
+                grid[r][c] = "d" if (r + c) % 8 == 4 else "*"   # Стена комнаты с открытой дверью
+            else:
+                grid[r][c] = rnd.choice("     " * 6 + "BB__DFfC")
+    grid[1][1] = " "
+    receivers = [(r, c) for r in range(rows) for c in range(cols) if grid[r][c] in RECEIVERS]
+    activators = [(r, c) for r in range(rows) for c in range(cols) if grid[r][c] in ACTIVATORS]
+    connections = {}
+    if receivers:
+        for r, c in activators:
+            connections["{},{}".format(r, c)] = ["{},{}".format(*rnd.choice(receivers)) for _ in range(links)]
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "map.txt"), "w") as f:
+        f.write("\n".join("".join(row) for row in grid))
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump({"name": "bench-{}x{}".format(rows, cols), "start_pos": "1,1",
+                   "connections": connections, "info_text": {}}, f)
+    return folder
+
+
+def measure(func, repeat):
+    """Выполняет func repeat раз, возвращает длительности в миллисекундах"""
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        out.append((time.perf_counter() - t) * 1000)
+    return out
+
+
+def allocated(func):
+    """Сколько килобайт памяти func занимает на пике сверх уже занятой (по tracemalloc)"""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (peak - base) / 1024
+
+
+def summary(durs):
+    durs = sorted(durs)
+    return {"n": len(durs), "min_ms": durs[0], "p50_ms": durs[len(durs) // 2],
+            "mean_ms": sum(durs) / len(durs), "max_ms": durs[-1]}
+
+
+def start_exec(folder, screen):
+    """Запускает GLevelExec без главного цикла: уровень загружен, кадры вызываются вручную"""
+    main.level_main = ex = main.GLevelExec(screen, folder, script="")
+    ex.g_cycle = 0
+    ex.now = 0.0
+    ex.tweens = main.GTweens()
+    ex.start()
+    return ex
+
+
+def bench_level(folder, repeat, screen):
+    res = {}
+
+    def load_cold():            # Разбор исходников без кеша в памяти и на диске
+        main.GLevel.compiled.pop(folder, None)
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(folder, main.LEVEL_CACHE))
+        main.GLevel.Load(folder, (ex.all_sprites, ex.cell_group))
+
+    def load_warm():            # Повторный запуск уровня
+        main.GLevel.Load(folder, (ex.all_sprites, ex.cell_group))
+
+    ex = start_exec(folder, screen)
+    res["load_cold"] = summary(measure(load_cold, max(1, repeat // 4)))
+    res["load_warm"] = summary(measure(load_warm, repeat))
+
+    ex = start_exec(folder, screen)
+    mt = ex.field.mt
+    res["cells"] = mt.row_count() * mt.column_count()
+    res["cell_objects"] = len(mt.cells())
+
+    def frame_logic():          # Шаг симуляции без ввода: время машины, очередь, перемещения, логика уровня
+        ex.now += 1 / ex.sim_rate
+        ex.queue.run()
+        ex.tweens.update(ex.now)
+        ex.update()
+
+    def frame_render():
+        ex.full_redraw = True
+        frame_logic()
+        ex.manage_cycle()
+
+    res["frame_logic"] = summary(measure(frame_logic, repeat * 5))
+    ex.headless = False
+    res["frame_render"] = summary(measure(frame_render, repeat * 5))
+    ex.headless = True
+
+    step = next(((dr, dc) for dr, dc in main.GLevelExec.MOVES.values()
+                 if mt.walkable(ex.player.field_pos.r() + dr, ex.player.field_pos.c() + dc)), None)
+    if step is not None:
+        dirs = [step, (-step[0], -step[1])]
+
+        def move():             # Ход до конца анимации, с сигналами клеток. Ходы туда и обратно чередуются
+            ex.player.change_cell(*dirs[0])
+            while main.action_socket["PLAYER_WALK"]:
+                frame_logic()
+            dirs.reverse()
+
+        res["player_move"] = summary(measure(move, repeat))
+
+    net = ex.field.signals
+    buttons = sorted((i for i in net.connect if mt.codes[i] == ord("B")), key=lambda i: -len(net.connect[i]))
+    if buttons:
+        button = mt.cell(buttons[0])
+
+        def toggle():           # Переключение кнопки с наибольшим числом связей
+            button.on_activation()
+            ex.field.signals.flush()
+
+        res["signal_fanout"] = dict(summary(measure(toggle, repeat)), links=len(net.connect[buttons[0]]))
+
+    dispenser = mt.codes.find(b"C")
+    if dispenser != -1:
+        cell = mt.cell(dispenser)
+        ex.player.field_pos.stand(*cell.field_pos.pos())
+
+        def takeable():         # Создание, подбор, выброс и уничтожение куба
+            cell.item.create(cell.field_pos)
+            cell.item.take()
+            ex.player.release().die()
+
+        cell.auto_new = False
+        res["takeable_cycle"] = summary(measure(takeable, repeat))
+
+    def restore():              # Перезапуск на месте: объекты клеток и кубы создаются заново (кубы - из пула)
+        ex.restore(ex.initial)
+
+    restore()
+    res["restore"] = dict(summary(measure(restore, repeat)), alloc_kb=allocated(restore))
+
+    rnd = random.Random(0)      # Кубы по всему полю: рисоваться должны только те, что у экрана
+    free = [m.start() for m in re.finditer(b" ", mt.codes)]
+    for index in rnd.sample(free, min(len(free), CROWD)):
+        main.Cube((ex.all_sprites,)).create(ex.field.FieldPos(*mt.pos(index)))
+    ex.headless = False
+    view = ex.camera.view(ex.window_size, main.VIEW_MARGIN)
+    res["frame_render_crowd"] = dict(summary(measure(frame_render, repeat * 5)),
+                                     takeables=len(ex.takeable_group), drawn=len(ex.takeable_group.query(view)))
+    main.level_main = None
+    return res
+
+
+def bench_tweens(repeat, count=TWEENS):
+    """Одновременное перемещение count спрайтов: один кадр GTweens.update"""
+    tweens = main.GTweens()
+    sprites = [main.GSprite(rectf=[0, 0, 10, 10]) for _ in range(count)]
+    for i, spr in enumerate(sprites):
+        tweens.add(spr, 1000 + i, 1000 - i, 3600, easing=i % 2)
+    frames = iter(range(1, 10 ** 9))
+    res = summary(measure(lambda: tweens.update(next(frames) / 60), repeat * 5))
+    return {"level": "tweens", "sprites": count, "frame_tweens": res}
+
+
+def bench_sprites(repeat, count=SPRITES):
+    """Основа всех спрайтов: память на один GSprite (с общим изображением, без групп) и стоимость
+    move/stand - их вызывают перемещения, камера и раскладка кубов"""
+    image = main.IMG["cube"]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sprites = [main.GSprite(rectf=[i, i, 15, 15], image=image) for i in range(count)]
+    size = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    def move():
+        for spr in sprites:
+            spr.move(0.5, -0.5)
+
+    def stand():
+        for spr in sprites:
+            spr.stand(10.25, 20.75)
+
+    return {"level": "sprites", "sprites": count, "bytes_per_sprite": size,
+            "move_x{}".format(count): summary(measure(move, repeat)),
+            "stand_x{}".format(count): summary(measure(stand, repeat)),
+            "create_x{}".format(count): summary(measure(lambda: [main.GSprite(rectf=[0, 0, 15, 15], image=image)
+                                                                 for _ in range(count)], max(1, repeat // 4)))}
+
+
+def bench_replay(path, repeat):
+    """Повтор записанной игры целиком. Код выхода и число шагов одинаковы от прогона к прогону -
+    запись годится и как проверка, что поведение уровня не изменилось"""
+    out = []
+    res = summary(measure(lambda: out.append(main.replay(path)), repeat))
+    codes = set(out)
+    return {"level": "replay-" + os.path.basename(path), "exit_code": out[0][0], "ticks": out[0][1],
+            "stable": len(codes) == 1, "ticks_per_s": out[0][1] / (res["p50_ms"] / 1000), "replay": res}
+
+
+def run(sizes, repeat, tmp, replays=None):
+    pg.display.init()
+    pg.display.set_mode((1, 1))
+    main.load_data()
+    screen = pg.Surface(main.SCREEN_SIZE)
+    root = os.path.join("data", "lvls")
+    levels = [(name, os.path.join(root, name)) for name in sorted(os.listdir(root))]
+    levels += [("gen-{}".format(n), generate_level(os.path.join(tmp, str(n)), n, n)) for n in sizes]
+    results = []
+    for name, folder in levels:
+        entry = {"level": name}
+        t = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                entry.update(bench_level(folder, repeat, screen))
+        except (pg.error, MemoryError) as e:
+            entry["error"] = "{}: {}".format(type(e).__name__, e)
+        entry["wall_s"] = time.perf_counter() - t
+        print(name, "error" if "error" in entry else "ok", "{:.1f}s".format(entry["wall_s"]), file=sys.stderr)
+        results.append(entry)
+    results.append(bench_tweens(repeat))
+    results.append(bench_sprites(repeat))
+    if replays is not None:
+        for name in sorted(os.listdir(replays)):
+            if name.endswith(".rec"):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results.append(bench_replay(os.path.join(replays, name), max(1, repeat // 4)))
+    return {"meta": {"python": platform.python_version(), "pygame": pg.version.ver,
+                     "platform": platform.platform(), "time": time.time(), "repeat": repeat},
+            "results": results}
+
+
+def main_(*args):
+    sizes = DEFAULT_SIZES
+    repeat = 20
+    out = "bench.json"
+    replays = None
+    if "--sizes" in args:
+        sizes = [int(i) for i in args[args.index("--sizes") + 1].split(",") if i]
+    if "--repeat" in args:
+        repeat = int(args[args.index("--repeat") + 1])
+    if "--out" in args:
+        out = args[args.index("--out") + 1]
+    if "--replays" in args:
+        replays = args[args.index("--replays") + 1]
+    tmp = tempfile.mkdtemp(prefix="trial-bench-")
+    try:
+        data = run(sizes, repeat, tmp, replays)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    with open(out, "w") as f:
+        json.dump(data, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_(*sys.argv))
@@ -7,8 +7,21 @@ except launching like a single application for personal use only"""
 import pygame as pg
 import os
 import abc
+import re
 import json
-from random import randint
+import time
+import zlib
+import struct
+import hashlib
+import contextlib
+import traceback
+import heapq
+import itertools
+import threading
+import collections
+import concurrent.futures
+from array import array
+import random
 
 
 # DAY1:     Created base, don't tested.
@@ -41,13 +54,16 @@ def concat(*funcs):
 def load_image(name, chr_key=None) -> pg.Surface:
     """Загрузить изображение из папки data с указанным именем и конвертировать"""
     fullname = os.path.join('data', name)
-    image = pg.image.load(fullname).convert()
+    image = pg.image.load(fullname)
+    windowed = pg.display.get_surface() is not None     # Без окна конвертировать изображения не во что
+    if windowed:
+        image = image.convert()
 
     if chr_key is not None:
         if chr_key == -1:
             chr_key = image.get_at((0, 0))
         image.set_colorkey(chr_key)
-    else:
+    elif windowed:
         image = image.convert_alpha()
     return image
 
@@ -70,27 +86,449 @@ def load_data():
     IMG["fizzler"] = load_image("fizzler.png")
     IMG["info"] = load_image("info.png")
     IMG["exit"] = load_image("exit.png")
+    TEXTURES.clear()
+    if TEXTURE_ATLAS:
+        TEXTURES.pack(CELL_IMAGES)
 
 
 IMG = {}            # Словарь, содержащий загруженные изображения
 level_main = None           # Будущий Объект GMain. Хранится для доступа без передачи в качестве аргумента
 action_socket = {}  # Хранилище логических ячеек, нужен для указания того, может ли GAction выполниться сейчас
+RNG = random.Random()       # Случайность игровой логики. Зерно задается в начале уровня (GLevelExec.start)
 
 
 #  CONSTS --------------------
 FIELD_SIZE = FIELD_WIDTH, FIELD_HEIGHT = 10, 10
+SCREEN_SIZE = 800, 600
+LEVEL_CACHE = "compiled.bin"            # Файл скомпилированного уровня, лежит рядом с map.txt
+LEVEL_CACHE_VERSION = 2
+INPUT_LOG_VERSION = 1                   # Версия формата записи ввода, см. GInputLog
+SAVE_FILE = os.path.join("user_files", "save_file.bin")
+LEGACY_SAVE_FILE = os.path.join("user_files", "save_file.ini")     # Старое сохранение: только номер уровня
+SAVE_VERSION = 1
+AUTOSAVE_TIME = 10                      # Раз во сколько секунд игры сохраняется положение на уровне
 CELL_SIZE = 50                          # Position = center
 DEFAULT_IMAGE = "default"
+CELL_IMAGES = ("empty", "default", "button", "door_open", "door_closed", "cube_dispenser", "fizzler", "info",
+               "exit", "pressure_button_activated", "pressure_button_deactivated")
+TEXTURE_ATLAS = False                   # Складывать изображения клеток в один атлас
+CHUNK_SIZE = 16                         # Сторона чанка поля в клетках, см. GLevel.activate
+ACTIVE_CHUNKS = 1                       # На сколько чанков от игрока у клеток есть объекты
+GRID_SIZE = 4 * CELL_SIZE               # Сторона ячейки сетки GGridGroup в пикселях
+VIEW_MARGIN = CELL_SIZE                 # Запас вокруг экрана при выборе спрайтов для отрисовки
+WALK_TIME = 5 / 60                      # Время перехода игрока на соседнюю клетку, секунды
+INPUT_BUFFER = 3                        # Сколько команд игрока может ждать конца ходьбы
+POOL_LIMIT = 256                        # Сколько свободных объектов держит GPool
+REDRAW_EVENTS = (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED, pg.WINDOWSHOWN, pg.WINDOWRESTORED,   # После них окно
+                 pg.WINDOWMAXIMIZED, pg.WINDOWSIZECHANGED)      # перерисовывается целиком, см. invalidate
+INPUT_EVENTS = (pg.QUIT, pg.KEYDOWN) + REDRAW_EVENTS    # Остальные события pygame в очередь не попадают
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40    # Уровни записей журнала, см. log
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LOG_BUFFER = 10000                      # Сколько последних записей журнала держится в памяти
+LOG_FLUSH_TIME = 1.0                    # Раз во сколько секунд журнал дописывается в файл
+CRASH_LOG = os.path.join("user_files", "crash_log.jsonl")     # Последние записи при падении игры
 # noinspection PyArgumentList
 COLORS = {
     "background": pg.Color(1, 5, 14),
     "foreground": pg.Color(101, 105, 114),
+    "text": pg.Color("white"),
 }
 
 
 # \CONSTS --------------------
 
 
+class GTask:
+    """Задача в очереди машины. Отмененная задача остается в очереди, но не выполняется"""
+    __slots__ = ("func", "cancelled")
+
+    def __init__(self, func):
+        assert callable(func)
+        self.func = func
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __call__(self):
+        if not self.cancelled:
+            return self.func()
+
+
+class GScheduler:
+    """Очередь задач машины. Задача, добавленная во время кадра, выполнится на следующем кадре,
+    отложенная на delay кадров - на столько кадров позже. Если задан budget (секунды), то задачи,
+    не уложившиеся в него, переносятся на следующий кадр, а не растягивают текущий"""
+    def __init__(self, budget=None):
+        self.ready = collections.deque()
+        self.delayed = []                   # Куча из (кадр, номер, задача)
+        self.frame = 0
+        self.budget = budget
+        self._order = itertools.count()     # Сохраняет порядок задач с одинаковым кадром
+
+    def schedule(self, func, delay=0) -> GTask:
+        task = func if isinstance(func, GTask) else GTask(func)
+        if delay > 0:
+            heapq.heappush(self.delayed, (self.frame + 1 + delay, next(self._order), task))
+        else:
+            self.ready.append(task)
+        return task
+
+    append = schedule
+
+    @staticmethod
+    def cancel(task: GTask):
+        task.cancel()
+
+    def run(self):
+        """Выполнение задач одного кадра. Хотя бы одна задача выполняется всегда"""
+        self.frame += 1
+        while self.delayed and self.delayed[0][0] <= self.frame:
+            self.ready.append(heapq.heappop(self.delayed)[2])
+        deadline = None if self.budget is None else time.perf_counter() + self.budget
+        traced = TRACER.enabled
+        for _ in range(len(self.ready)):
+            task = self.ready.popleft()
+            if traced:
+                with TRACER.span(task.func):
+                    task()
+            else:
+                task()
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+    def clear(self):
+        self.ready.clear()
+        self.delayed.clear()
+
+    def __len__(self):
+        return len(self.ready) + len(self.delayed)
+
+
+class GTweens:
+    """Плавные перемещения спрайтов по времени. Все активные перемещения лежат в массивах (начало,
+    конец, время начала, длительность, сглаживание), и update() проходит их одним циклом, без
+    задач в очереди и цепочки вызовов на каждый спрайт. Положение зависит только от прошедшего
+    времени, а не от числа кадров. По окончании вызывается задача, которую вернул add()"""
+    LINEAR = 0
+    SMOOTH = 1          # Плавный разгон и торможение (smoothstep)
+
+    def __init__(self):
+        self.now = 0.0
+        self.sx, self.sy, self.ex, self.ey = array("d"), array("d"), array("d"), array("d")
+        self.t0, self.dur = array("d"), array("d")
+        self.ease = array("B")
+        self.targets = []
+        self.tasks = []
+
+    def add(self, target, x, y, dur, on_end=lambda: None, easing=LINEAR) -> GTask:
+        """Перемещение target в (x, y) за dur секунд, начиная с текущего времени. Задачу можно
+        отменить - тогда спрайт останется, где был, а on_end не вызовется"""
+        task = GTask(on_end)
+        self.sx.append(target.x())
+        self.sy.append(target.y())
+        self.ex.append(x)
+        self.ey.append(y)
+        self.t0.append(self.now)
+        self.dur.append(dur)
+        self.ease.append(easing)
+        self.targets.append(target)
+        self.tasks.append(task)
+        return task
+
+    def apply(self, now) -> list:
+        """Ставит спрайты в положение на момент now. Возвращает номера закончившихся и отмененных"""
+        sx, sy, ex, ey, t0, dur, ease = self.sx, self.sy, self.ex, self.ey, self.t0, self.dur, self.ease
+        over = []
+        for i, target in enumerate(self.targets):
+            if self.tasks[i].cancelled:
+                over.append(i)
+                continue
+            k = (now - t0[i]) / dur[i] if dur[i] > 0 else 1.0
+            if k >= 1 - 1e-9:       # С запасом на погрешность сложения времени шагов
+                k = 1.0
+                over.append(i)
+            elif ease[i] == self.SMOOTH:
+                k = k * k * (3 - 2 * k)
+            target.stand(sx[i] + (ex[i] - sx[i]) * k, sy[i] + (ey[i] - sy[i]) * k)
+        return over
+
+    def sample(self, now):
+        """Положение спрайтов на момент now без завершения перемещений. Нужно для отрисовки между
+        шагами симуляции: следующий update() все равно пересчитает положения по своему времени"""
+        self.apply(now)
+
+    def update(self, now):
+        """Продвигает все перемещения к моменту now (секунды). Закончившиеся убираются из массивов,
+        их задачи выполняются после прохода"""
+        self.now = now
+        if not self.targets:
+            return
+        over = self.apply(now)
+        done = [self.tasks[i] for i in over if not self.tasks[i].cancelled]
+        if over:
+            over = set(over)
+            keep = [i for i in range(len(self.targets)) if i not in over]
+            for name in ("sx", "sy", "ex", "ey", "t0", "dur", "ease"):
+                old = getattr(self, name)
+                setattr(self, name, array(old.typecode, [old[i] for i in keep]))
+            self.targets = [self.targets[i] for i in keep]
+            self.tasks = [self.tasks[i] for i in keep]
+        for task in done:
+            task()
+
+    def finish(self):
+        """Завершает все перемещения сразу: спрайты встают в конечные точки, задачи выполняются"""
+        now = self.now
+        self.update(max((t + d for t, d in zip(self.t0, self.dur)), default=now))
+        self.now = now
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self.targets)
+
+
+class GTextureCache:
+    """Общий кеш изображений из IMG, приведенных к нужному размеру. Ключ - (имя, размер, формат пикселей),
+    так что все клетки с одинаковым изображением используют одну и ту же поверхность, а смена
+    изображения клетки ничего не создает. После pack() изображения хранятся в одном атласе"""
+    def __init__(self):
+        self.items = {}
+        self.atlas = None
+
+    @staticmethod
+    def key(name, size):
+        src = IMG[name]
+        return name, tuple(size), src.get_bitsize(), bool(src.get_flags() & pg.SRCALPHA)
+
+    def get(self, name, size=None) -> pg.Surface:
+        size = (CELL_SIZE, CELL_SIZE) if size is None else size
+        key = self.key(name, size)
+        tex = self.items.get(key)
+        if tex is None:
+            tex = IMG[name] if IMG[name].get_size() == tuple(size) else pg.transform.scale(IMG[name], size)
+            self.items[key] = tex
+        return tex
+
+    def pack(self, names, size=None):
+        """Размещает изображения names (размера size) в одном атласе. Прозрачный цвет переводится
+        в прозрачность атласа, дальше кеш выдает подповерхности атласа"""
+        size = (CELL_SIZE, CELL_SIZE) if size is None else tuple(size)
+        self.atlas = pg.Surface((size[0] * len(names), size[1]), pg.SRCALPHA)
+        for i, name in enumerate(names):
+            self.atlas.blit(self.get(name, size), (i * size[0], 0))
+        for i, name in enumerate(names):
+            self.items[self.key(name, size)] = self.atlas.subsurface((i * size[0], 0, *size))
+
+    def clear(self):
+        self.items.clear()
+        self.atlas = None
+
+
+TEXTURES = GTextureCache()
+
+
+class GTextCache:
+    """Реестр шрифтов и LRU-кеш отрисованного текста. Шрифт создается один раз на (имя, размер),
+    строка хранится по ключу (шрифт, текст, цвет, сглаживание). Когда отрисованные строки
+    занимают больше limit байт, выбрасываются те, что дольше всего не использовались"""
+    def __init__(self, limit=4 * 1024 * 1024):
+        self.fonts = {}
+        self.items = collections.OrderedDict()
+        self.limit = limit
+        self.used = 0
+
+    def font(self, name, size) -> pg.font.Font:
+        key = (name, size)
+        if key not in self.fonts:
+            self.fonts[key] = pg.font.SysFont(name, size)
+        return self.fonts[key]
+
+    def render(self, font: pg.font.Font, text, color, antialias=False) -> pg.Surface:
+        key = (font, text, tuple(color), antialias)
+        surf = self.items.get(key)
+        if surf is not None:
+            self.items.move_to_end(key)
+            return surf
+        surf = self.items[key] = font.render(text, antialias, color)
+        self.used += surf.get_pitch() * surf.get_height()
+        while self.used > self.limit and len(self.items) > 1:
+            _, old = self.items.popitem(last=False)
+            self.used -= old.get_pitch() * old.get_height()
+        return surf
+
+    def clear(self):    # Нужно вызвать перед pg.font.quit(), после него шрифты недействительны
+        self.fonts.clear()
+        self.items.clear()
+        self.used = 0
+
+
+TEXTS = GTextCache()
+
+
+class GTraceSpan:
+    """Замер одного участка кода. Используется как контекстный менеджер, см. GTracer.span"""
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter())
+
+
+class GTracer:
+    """Замер времени фаз кадра, задач очереди и вложенных машин. Выключенный (enabled = False)
+    возвращает из span() общий пустой контекст и почти ничего не стоит. Включенный копит события
+    (последние limit штук) для выгрузки в формате Chrome trace (chrome://tracing, Perfetto) и
+    последние window длительностей каждого участка для перцентилей"""
+    NULL = contextlib.nullcontext()
+
+    def __init__(self, window=600, limit=1000000):
+        self.enabled = False
+        self.window = window
+        self.events = collections.deque(maxlen=limit)
+        self.stats = {}         # Имя участка -> последние длительности
+        self.t0 = time.perf_counter()
+
+    def span(self, owner, phase=None):
+        """Замер участка. Имя - имя функции owner или класса объекта owner, плюс phase"""
+        if not self.enabled:
+            return self.NULL
+        name = getattr(owner, "__qualname__", None) or type(owner).__name__
+        return GTraceSpan(self, name if phase is None else name + "." + phase)
+
+    def record(self, name, start, end):
+        self.events.append((name, start, end))
+        if name not in self.stats:
+            self.stats[name] = collections.deque(maxlen=self.window)
+        self.stats[name].append(end - start)
+
+    def percentiles(self, ps=(50, 90, 99)):
+        """Перцентили длительностей (в миллисекундах) по последним window замерам каждого участка"""
+        out = {}
+        for name, durs in self.stats.items():
+            durs = sorted(durs)
+            out[name] = {"count": len(durs)}
+            for p in ps:
+                out[name]["p{}".format(p)] = durs[min(len(durs) - 1, len(durs) * p // 100)] * 1000
+        return out
+
+    def dump(self, path):       # Выгрузка событий в формате Chrome trace
+        pid = os.getpid()
+        with open(path, "w") as f:
+            json.dump({"traceEvents": [{"name": name, "ph": "X", "pid": pid, "tid": 0,
+                                        "ts": (start - self.t0) * 1e6, "dur": (end - start) * 1e6}
+                                       for name, start, end in self.events],
+                       "displayTimeUnit": "ms"}, f)
+
+    def dump_stats(self, path):
+        with open(path, "w") as f:
+            json.dump(self.percentiles(), f, indent=2)
+
+
+TRACER = GTracer()
+
+
+class GLogger:
+    """Журнал для log(). Записи ниже level отбрасываются сразу, до форматирования. Остальные ложатся
+    кортежами (время, уровень, father, sender, сообщение) в кольцевой буфер на LOG_BUFFER записей, а поток
+    журнала раз в LOG_FLUSH_TIME дописывает новые в файл строками JSON (если файл задан, см. open).
+    Записи от echo и выше сразу печатаются в консоль. Последние записи можно выгрузить при падении (dump)"""
+    NAMES = {level: name for name, level in LOG_LEVELS.items()}
+
+    def __init__(self, size=LOG_BUFFER, level=INFO, echo=WARNING):
+        self.level = level
+        self.echo = echo
+        self.records = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.count = 0              # Сколько записей добавлено всего
+        self.flushed = 0            # Сколько из них уже разобрано потоком журнала
+        self.file = None
+        self.thread = None
+        self.stop = threading.Event()
+
+    def add(self, level, father, sender, mes):
+        with self.lock:
+            self.records.append((time.time(), level, father, sender, mes))
+            self.count += 1
+
+    def take(self):
+        """Записи, добавленные с прошлого вызова, и сколько их вытеснено из буфера, не дождавшись записи"""
+        with self.lock:
+            n = min(self.count - self.flushed, len(self.records))
+            batch = list(itertools.islice(self.records, len(self.records) - n, None))
+            lost = self.count - self.flushed - n
+            self.flushed = self.count
+        return batch, lost
+
+    @classmethod
+    def format(cls, record) -> str:
+        t, level, father, sender, mes = record
+        return json.dumps({"time": t, "level": cls.NAMES.get(level, level), "father": father, "sender": sender,
+                           "message": mes}, ensure_ascii=False)
+
+    @staticmethod
+    def text(father, sender, mes) -> str:
+        """Запись в виде для консоли: "[FATHER/sender] mes" """
+        if father is not None:
+            if sender is None:
+                sender = str(father).upper()
+            else:
+                sender = "{}/{}".format(str(father).upper(), str(sender))
+        if sender is not None:
+            mes = "[{}] ".format(str(sender)) + mes
+        return mes
+
+    def open(self, path):
+        """Начать писать журнал в файл path в фоновом потоке"""
+        self.file = open(path, "a", encoding="utf-8")
+        self.stop.clear()
+        self.thread = threading.Thread(target=self.run, name="GLogger", daemon=True)
+        self.thread.start()
+
+    def run(self):              # Поток журнала
+        while not self.stop.wait(LOG_FLUSH_TIME):
+            self.flush()
+
+    def flush(self):
+        batch, lost = self.take()
+        lines = [self.format(record) for record in batch]
+        if lost:
+            lines.insert(0, self.format((time.time(), WARNING, "log", "flush", "{} records lost".format(lost))))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    def close(self):
+        """Остановить поток и дописать оставшиеся записи"""
+        if self.thread is None:
+            return
+        self.stop.set()
+        self.thread.join()
+        self.thread = None
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    def dump(self, path):
+        """Выгрузка всех записей из буфера. Не зависит от потока журнала - годится при падении"""
+        with self.lock:
+            batch = list(self.records)
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(self.format(record) + "\n" for record in batch)
+
+
+LOGGER = GLogger()
+
+
 class GMachine(metaclass=abc.ABCMeta):
     """
     Абстрактный класс игровой машины. Представлен следующей структурой:
@@ -144,10 +582,45 @@ class GMachine(metaclass=abc.ABCMeta):
 class GPygameMachine(GMachine):
     """Адаптация класса игровой машины под pygame. Содержит те функции, которые обязательно будут в любом
     подклассе"""
+    frame_budget = None         # Время (в секундах) на выполнение очереди за кадр. None - без ограничений
+    sim_rate = 60               # Шагов симуляции в секунду. Логика и перемещения идут только шагами
+    fps = 60                    # Ограничение частоты отрисовки. 0 - без ограничения
+    interpolate = True          # Рисовать перемещения по реальному времени между шагами
+    headless = False            # Работа без окна: события pygame не читаются, кадры не выводятся
+    max_frame_time = 0.25       # Больше за кадр время не продвигается (медленный кадр, отладчик)
+    resumed = 0.0               # Когда последняя машина вернула управление, см. __advance
+
     def __start(self):
-        self.queue = []
+        self.queue = GScheduler(self.frame_budget)
+        self.tweens = GTweens()
+        self.now = 0.0          # Время машины в секундах, по нему идут плавные перемещения
+        self.lag = 0.0          # Прошедшее реальное время, еще не разобранное шагами симуляции
         self.start()
         self.clock = pg.time.Clock()
+        self.last_frame = time.perf_counter()
+
+    def __advance(self) -> int:
+        """Сколько шагов симуляции сделать в этом кадре. Без окна - ровно один, так что прохождение
+        не зависит от скорости компьютера. С окном прошедшее время копится в lag и расходуется целыми
+        шагами. Время, пока работала вложенная машина (пауза, текст), не считается"""
+        if self.headless:
+            return 1
+        t = time.perf_counter()
+        self.lag += min(t - max(self.last_frame, GPygameMachine.resumed), self.max_frame_time)
+        self.last_frame = t
+        steps = int(self.lag * self.sim_rate + 1e-9)
+        self.lag -= steps / self.sim_rate
+        return steps
+
+    def __step(self):           # Один шаг симуляции длиной 1 / sim_rate
+        self.now += 1 / self.sim_rate
+        with TRACER.span(self, "queue"):
+            self.queue.run()
+        with TRACER.span(self, "tweens"):
+            self.tweens.update(self.now)
+        self.g_cycle += 1
+        with TRACER.span(self, "update"):
+            self.update()
 
     @abc.abstractmethod
     def start(self):
@@ -161,7 +634,9 @@ class GPygameMachine(GMachine):
         pass
 
     def __handle_input(self):
-        if pg.event.get(pg.QUIT):
+        """События pygame забираются из очереди один раз за кадр и лежат в self.events"""
+        self.events = [] if self.headless else pg.event.get()
+        if any(event.type == pg.QUIT for event in self.events):
             self.exit_code = 1
         self.handle_input()
 
@@ -170,29 +645,47 @@ class GPygameMachine(GMachine):
         pass
 
     def __manage_cycle(self):
-        _ = self.queue.copy()
-        while len(_) > 0:
-            # print(_)
-            _.pop(0)()
-            self.queue.pop(0)
-
-        self.g_cycle += 1
-        pg.display.flip()
-        self.manage_cycle()
-        self.clock.tick(60)
+        for _ in range(self.__advance()):
+            self.__step()
+            if self.exit_code != -1:
+                break
+        if self.interpolate and not self.headless:
+            self.tweens.sample(self.now + self.lag)
+        if not self.headless:
+            with TRACER.span(self, "present"):
+                self.present()
+        with TRACER.span(self, "manage_cycle"):
+            self.manage_cycle()
+        if self.fps:
+            with TRACER.span(self, "tick"):
+                self.clock.tick(self.fps)
+
+    def update(self):
+        """Шаг симуляции. Вызывается sim_rate раз в секунду независимо от частоты отрисовки"""
+        pass
 
     @abc.abstractmethod
     def manage_cycle(self):
+        """Отрисовка кадра. Вызывается раз в кадр, не чаще fps"""
         pass
 
+    def present(self):
+        """Вывод нарисованного кадра на экран. По умолчанию обновляется весь экран"""
+        pg.display.flip()
+
     def main(self):
-        self.g_cycle = 0
-        self.__start()
-        self.exit_code = -1
-        while self.exit_code == -1:
-            self.__handle_input()
-            self.__manage_cycle()
-        self.__quit()
+        with TRACER.span(self, "main"):
+            self.g_cycle = 0
+            with TRACER.span(self, "start"):
+                self.__start()
+            self.exit_code = -1
+            while self.exit_code == -1:
+                with TRACER.span(self, "frame"):
+                    with TRACER.span(self, "handle_input"):
+                        self.__handle_input()
+                    self.__manage_cycle()
+            self.__quit()
+        GPygameMachine.resumed = time.perf_counter()
         return self.exit_code
 
 
@@ -216,14 +709,14 @@ class GTextPopup(GPygameMachine):
 
     def start(self):
         pg.font.init()
-        self.im = pg.font.SysFont("Consolas", 30)
+        self.im = TEXTS.font("Consolas", 30)
         self.surface = pg.Surface(self.rect.size)
 
     def quit(self):
         pass
 
     def handle_input(self):
-        for event in pg.event.get():
+        for event in self.events:
             if event.type == pg.KEYDOWN:
                 self.exit_code = 0
 
@@ -231,7 +724,7 @@ class GTextPopup(GPygameMachine):
         pg.draw.rect(self.surface, COLORS["background"], (0, 0, *self.rect.size))
         pg.draw.rect(self.surface, COLORS["foreground"], (0, 0, *self.rect.size), 10)
         for i in range(len(self.mes)):
-            self.surface.blit(self.im.render(self.mes[i], False, pg.Color("white")), (10, 10 + 30 * i))
+            self.surface.blit(TEXTS.render(self.im, self.mes[i], COLORS["text"]), (10, 10 + 30 * i))
         self.par.blit(self.surface, self.rect.topleft)
 
 
@@ -250,59 +743,71 @@ class GBrutalTextAnimation(GPygameMachine):
         pass
 
     def handle_input(self):
-        for event in pg.event.get():
+        for event in self.events:
             if event.type == pg.KEYDOWN and event.key == pg.K_s:
                 self.exit_code = 0
 
     def manage_cycle(self):
         pg.draw.rect(self.surface, pg.Color("black"), self.surface.get_rect())
         for i, line in enumerate(GTextPopup.split_text(self.text, 22)):
-            self.surface.blit(self.im.render(line, False,
-                                             (255 / 100 * self.tr,
-                                              255 / 100 * self.tr,
-                                              255 / 100 * self.tr)), (10, 100 + 60 * i))
+            self.surface.blit(TEXTS.render(self.im, line,
+                                           (int(255 / 100 * self.tr),
+                                            int(255 / 100 * self.tr),
+                                            int(255 / 100 * self.tr))), (10, 100 + 60 * i))
+
+    def update(self):
         if self.g_cycle <= 100:
             self.tr = self.g_cycle
         elif 300 >= self.g_cycle >= 200:
             self.tr = 300 - self.g_cycle
-        if self.g_cycle == 330:
+        if self.g_cycle >= 330:
             self.exit_code = 0
 
 
 class GSprite(pg.sprite.Sprite):
     """Наследование класса спрайта. Создан, в основном, для удобства, а также решения проблемы
-    нецелых координат"""
+    нецелых координат: точное положение и размер лежат в fx, fy, fw, fh, а rect - их целая часть.
+    rect создается один раз и дальше меняется на месте. ident - номер спрайта, по нему называются
+    сокеты его анимаций"""
+    idents = itertools.count()
+
     def __init__(self, rectf=None, image=None, groups=()):
-        super(GSprite, self).__init__(*groups)
+        super(GSprite, self).__init__()
         self.image = image if image is not None else IMG[DEFAULT_IMAGE]
-        self.ident = str(randint(100, 100000000000))
+        self.ident = next(GSprite.idents)
         if rectf is None:
             self.rect = self.image.get_rect()
-            self.rectf = [self.rect.x, self.rect.y, self.rect.w, self.rect.h]
+            self.fx, self.fy, self.fw, self.fh = self.rect
         else:
-            pg.transform.scale(self.image, rectf[2:4])
-            self.rectf = rectf
-        self.commit()
+            self.fx, self.fy, self.fw, self.fh = rectf
+            self.rect = pg.Rect(int(self.fx), int(self.fy), int(self.fw), int(self.fh))
+        self.add(*groups)       # Группы с сеткой (GGridGroup) смотрят на rect
+
+    @property
+    def rectf(self):            # Нецелые координаты и размер одним списком (копия)
+        return [self.fx, self.fy, self.fw, self.fh]
 
     def move(self, dx, dy):     # Передвинуть на dx dy
-        self.rectf[0] += dx
-        self.rectf[1] += dy
-        self.commit()
+        self.fx += dx
+        self.fy += dy
+        self.rect.x = int(self.fx)
+        self.rect.y = int(self.fy)
 
     def stand(self, nx, ny):    # Поместить в nx ny
-        self.rectf[0] = nx
-        self.rectf[1] = ny
-        self.commit()
+        self.fx = nx
+        self.fy = ny
+        self.rect.x = int(nx)
+        self.rect.y = int(ny)
 
     def scale(self, nw, nh, image_scale=False):     # Установить размер
-        self.rectf[2] = nw
-        self.rectf[3] = nh
+        self.fw = nw
+        self.fh = nh
         if image_scale:
-            pg.transform.scale(self.image, (nw, nh))
+            self.image = pg.transform.scale(self.image, (int(nw), int(nh)))
         self.commit()
 
     def centerF(self):                  # Выдать координаты центра
-        return self.rectf[0] + self.rectf[2] / 2, self.rectf[1] + self.rectf[3] / 2
+        return self.fx + self.fw / 2, self.fy + self.fh / 2
 
     def center(self):                   # То же, что и centerF, только целые
         x, y = self.centerF()
@@ -315,28 +820,26 @@ class GSprite(pg.sprite.Sprite):
         o.stand(cx - ow / 2, cy - oh / 2)
 
     def pos(self):
-        return self.rectf[0], self.rectf[1]
+        return self.fx, self.fy
 
     def x(self):
-        return self.rectf[0]
+        return self.fx
 
     def y(self):
-        return self.rectf[1]
+        return self.fy
 
     def size(self):
-        return self.rectf[2], self.rectf[3]
+        return self.fw, self.fh
 
     def w(self):
-        return self.rectf[2]
+        return self.fw
 
     def h(self):
-        return self.rectf[3]
+        return self.fh
 
     def commit(self):                               # Перевод нецелых координат в целые. Вызывается
-        self.rect = pg.Rect(int(self.rectf[0]),     # после любого изменения объекта
-                            int(self.rectf[1]),
-                            int(self.rectf[2]),
-                            int(self.rectf[3]))
+        self.rect.update(int(self.fx), int(self.fy),    # после любого изменения объекта
+                         int(self.fw), int(self.fh))
 
 
 class TextButton(GSprite):
@@ -347,13 +850,12 @@ class TextButton(GSprite):
         self.selected = False
         self.text = text
         self.act = action
-        self.fnt = pg.font.SysFont("Arial", 20)
+        self.fnt = TEXTS.font("Arial", 20)
 
     def draw(self, surface: pg.Surface):
-        th = self.fnt.render(self.text, False, pg.Color("white"))
-        me = GSprite(image=th)
-        self.centrify(me)
-        pg.sprite.Group(me).draw(surface)
+        th = TEXTS.render(self.fnt, self.text, COLORS["text"])
+        cx, cy = self.centerF()
+        surface.blit(th, (int(cx - th.get_width() / 2), int(cy - th.get_height() / 2)))
 
 
 class GAction:
@@ -390,6 +892,7 @@ class GAnimation(GAction):
         self.dur = dur
         self.time = 0
         self.on_end = on_end
+        self.task = None
 
     @abc.abstractmethod
     def do(self):
@@ -401,25 +904,41 @@ class GAnimation(GAction):
         self.time += 1
         self.do()
         if self.time < self.dur:
-            level_main.queue.append(self.cycle)
+            self.task = level_main.queue.schedule(self.cycle)
         else:
+            self.task = None
             action_socket[self.socket] = False
             self.on_end()
 
     def start(self):
-        level_main.queue.append(self.cycle)
+        self.task = level_main.queue.schedule(self.cycle)
+
+    def cancel(self):
+        """Прерывание анимации. Сокет освобождается, on_end не вызывается"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            action_socket[self.socket] = False
 
 
 class GSpriteMoveAnimation(GAnimation):
-    """Специализированный класс анимации для плавного передвижения спрайта target по экрану"""
-    def __init__(self, target: GSprite, dx, dy, dur: int, on_end=lambda: None):
+    """Специализированный класс анимации для плавного передвижения спрайта target по экрану.
+    Длительность dur - в секундах, кадры не считаются: перемещение ведет GTweens машины"""
+    def __init__(self, target: GSprite, dx, dy, dur: float, on_end=lambda: None, easing=GTweens.LINEAR):
         super(GSpriteMoveAnimation, self).__init__(dur, "MOVE_ANIMATION-GS{}".format(str(target.ident)), on_end)
         self.tar = target
-        self.dx = dx / dur
-        self.dy = dy / dur
+        self.dx = dx
+        self.dy = dy
+        self.easing = easing
 
-    def do(self):
-        self.tar.move(self.dx, self.dy)
+    def start(self):
+        self.task = level_main.tweens.add(self.tar, self.tar.x() + self.dx, self.tar.y() + self.dy, self.dur,
+                                          self.finish, self.easing)
+
+    def finish(self):
+        self.task = None
+        action_socket[self.socket] = False
+        self.on_end()
 
 
 class GSpriteFadeAnimation(GAnimation):
@@ -447,30 +966,95 @@ class GSpriteFadeAnimation(GAnimation):
 
 
 class GCamera:
-    """Класс камеры. По умолчанию наблюдает за игроком"""
+    """Класс камеры. По умолчанию наблюдает за игроком. Положения объектов в мире не меняет,
+    а хранит смещение, с которым они выводятся на экран"""
     def __init__(self):
         self.dx = 0
         self.dy = 0
 
-    def apply(self, obj: GSprite):
-        """Передвигает переданный объект так, будто таргет находится в центре экрана, а
-        объект сохранил положение относительно объекта"""
-        obj.move(self.dx, self.dy)
+    def apply(self, obj: GSprite) -> pg.Rect:
+        """Возвращает прямоугольник, в котором переданный объект находится на экране"""
+        return obj.rect.move(self.dx, self.dy)
 
     def update(self, target: GSprite, screen_size):
-        """Меняет таргет"""
-        x, y = target.pos()
-        w, h = target.size()
-        self.dx = -(x + w // 2 - screen_size[0] // 2)
-        self.dy = -(y + h // 2 - screen_size[1] // 2)
+        """Меняет смещение так, чтобы таргет оказался в центре экрана"""
+        self.dx = screen_size[0] // 2 - target.rect.x - target.rect.w // 2
+        self.dy = screen_size[1] // 2 - target.rect.y - target.rect.h // 2
+
+    def offset(self):
+        return self.dx, self.dy
+
+    def view(self, screen_size, margin=0) -> pg.Rect:
+        """Часть мира, видимая на экране, расширенная на margin с каждой стороны"""
+        return pg.Rect(-self.dx - margin, -self.dy - margin,
+                       screen_size[0] + 2 * margin, screen_size[1] + 2 * margin)
+
+
+class GGridGroup(pg.sprite.Group):
+    """Группа спрайтов с сеткой: спрайт лежит во всех ячейках (size x size пикселей), которые задевает
+    его rect, поэтому query() по прямоугольнику смотрит только на спрайты рядом с ним. Положение
+    запоминается при добавлении - если спрайт в группе передвинули, нужно вызвать reindex()
+    (Takeable делает это сам, см. Takeable.stand)"""
+    def __init__(self, *sprites, size=GRID_SIZE):
+        self.size = size
+        self.grid = {}          # Ячейка (x, y) -> спрайты в ней (dict как упорядоченное множество)
+        self.keys = {}          # Спрайт -> ячейки, в которых он лежит
+        self.order = {}         # Спрайт -> номер добавления, чтобы query() сохраняла порядок группы
+        self.added = itertools.count()
+        super(GGridGroup, self).__init__(*sprites)
+
+    def cells(self, rect):
+        s = self.size
+        return [(x, y) for x in range(rect.left // s, (rect.right - 1) // s + 1)
+                for y in range(rect.top // s, (rect.bottom - 1) // s + 1)]
+
+    def add_internal(self, sprite, layer=None):
+        super(GGridGroup, self).add_internal(sprite)
+        self.order[sprite] = next(self.added)
+        self.insert(sprite)
+
+    def remove_internal(self, sprite):
+        super(GGridGroup, self).remove_internal(sprite)
+        self.erase(sprite)
+        del self.order[sprite]
+
+    def insert(self, sprite):
+        keys = self.keys[sprite] = self.cells(sprite.rect)
+        for key in keys:
+            self.grid.setdefault(key, {})[sprite] = None
+
+    def erase(self, sprite):
+        for key in self.keys.pop(sprite):
+            bucket = self.grid[key]
+            del bucket[sprite]
+            if not bucket:
+                del self.grid[key]
+
+    def reindex(self, sprite):      # Вызывается после перемещения спрайта, лежащего в группе
+        self.erase(sprite)
+        self.insert(sprite)
+
+    def query(self, rect: pg.Rect) -> list:
+        """Спрайты группы, пересекающие rect, в порядке группы"""
+        found = {}
+        for key in self.cells(rect):
+            bucket = self.grid.get(key)
+            if bucket:
+                found.update(bucket)
+        return sorted((i for i in found if i.rect.colliderect(rect)), key=self.order.__getitem__)
 
 
 class Cell(GSprite):
     """Класс клетки клетчатого поля. Является в некотором роде абстрактным и
     явно использоваться не должен. Имеет словарь свойств (используются игрой) и
     массив connect. Он используется для коммуникации м-у клетками. Для отправки сигнала
-    всем клеткам используется send(), при получении вызывается check_activators(). Остальные
-    функции вызываются игрой"""
+    всем клеткам используется send(), получатели узнают о нем через on_positive()/on_negative()
+    (см. GSignalNet). Остальные функции вызываются игрой.
+    Вдали от игрока клетка может жить только кодом и битами состояния в матрице поля, поэтому
+    всё её постоянное состояние должно восстанавливаться через restore() (см. GLevel.activate)"""
+    field_pos = None
+    index = None            # Номер клетки в матрице поля
+
     def __init__(self, image=None):
         super(Cell, self).__init__(image=image)
         self.params = {
@@ -478,8 +1062,7 @@ class Cell(GSprite):
             "activatable": False,
             "takeables": [],
         }
-        self.connect = []
-        self.activators = []
+        self.connect = []       # Связи для поля из объектов клеток, см. GLevel
         self.state = False
         self.field_pos = None
 
@@ -487,17 +1070,52 @@ class Cell(GSprite):
         """Вызывается полем во время создания. Без выполнения этой функции клетка не будет реагировать"""
         field_pos: GLevel.FieldMatrix.MatrixPos
         self.field_pos = field_pos
+        mt = self.field_pos.owner().mt
+        self.index = mt.index(*field_pos.pos())
+        mt.walk[self.index] = bool(self.params["walkable"])
+        mt.state[self.index] = bool(self.state)
         self.add(*self.field_pos.owner().mt_groups)
 
-    def check_activators(self):
-        if all(map(lambda c: c.state, self.activators)):
-            self.on_positive()
-        else:
-            self.on_negative()
+    def texture(self, state) -> pg.Surface:
+        """Изображение клетки в состоянии state. Нужно, чтобы рисовать клетку без объекта"""
+        return self.image
+
+    def restore(self, state):
+        """Восстановление клетки по биту состояния из матрицы. Вызывается до setup"""
+        self.state = bool(state)
+        self.image = self.texture(self.state)
+
+    def dormant(self):
+        """Можно ли убрать объект клетки, оставив в матрице только код и биты"""
+        return not self.params["takeables"]
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, value):     # Состояние дублируется в матрице поля
+        self._state = value
+        if self.field_pos is not None:
+            self.field_pos.owner().mt.state[self.index] = bool(value)
+
+    def set_walkable(self, value):
+        self.params["walkable"] = value
+        if self.field_pos is not None:
+            self.field_pos.owner().mt.walk[self.index] = bool(value)
+
+    @property
+    def image(self):
+        return self._image
 
-    def send(self):
-        for c in self.connect:
-            c.check_activators()
+    @image.setter
+    def image(self, value):     # Смена изображения сообщается полю, чтобы оно перерисовало клетку
+        self._image = value
+        if self.field_pos is not None:
+            self.field_pos.owner().on_cell_changed(self)
+
+    def send(self):     # Сообщить полю о своем состоянии. Вызывается после его изменения
+        self.field_pos.owner().signals.send(self.index, self.state)
 
     def on_stand(self):
         """Событие. Когда игрок встает на клетку"""
@@ -531,35 +1149,23 @@ class Cell(GSprite):
 def GetCell(char: str, *args):
     """Функция перекодировки символа в класс клетки. Используется при чтении и интерпретации файла уровня
     в текстовом виде"""
-    return {
-        " ": perform(EmptyCell),
-        "*": perform(WallCell),
-        "B": perform(EButtonCell),
-        "d": perform(DoorCell, False),
-        "D": perform(DoorCell, True),
-        "C": perform(CubeDispenserCell),
-        "_": perform(PressureButtonCell),
-        "F": perform(FizzlerCell, True),
-        "f": perform(FizzlerCell, False),
-        "I": perform(InfoCell),
-        "!": perform(ExitCell)
-    }[char]()
+    return CELL_TYPES[char]()
 
 
 class EmptyCell(Cell):      # Класс пустой клетки (по ней можно ходить)
     def __init__(self):
-        super(EmptyCell, self).__init__(IMG["empty"])
+        super(EmptyCell, self).__init__(TEXTURES.get("empty"))
 
 
 class WallCell(Cell):       # Класс клетки стены (в этой версии она цвета фона)
     def __init__(self):
-        super(WallCell, self).__init__(IMG["default"])
+        super(WallCell, self).__init__(TEXTURES.get("default"))
         self.params["walkable"] = False
 
 
 class EButtonCell(Cell):    # Класс клетки, встав на которую и нажав английскую E что-то произойдет
     def __init__(self):
-        super(EButtonCell, self).__init__(IMG["button"])
+        super(EButtonCell, self).__init__(TEXTURES.get("button"))
         self.params["activatable"] = True
 
     def on_activation(self):
@@ -571,26 +1177,28 @@ class DoorCell(Cell):       # Класс клетки двери, которая
     def __init__(self, closed=True):
         self.default = closed
         if closed:
-            super(DoorCell, self).__init__(IMG["door_closed"])
+            super(DoorCell, self).__init__(TEXTURES.get("door_closed"))
         else:
-            super(DoorCell, self).__init__(IMG["door_open"])
+            super(DoorCell, self).__init__(TEXTURES.get("door_open"))
+        self.state = closed
         self.params["walkable"] = not self.default
 
+    def texture(self, state):
+        return TEXTURES.get("door_closed" if state else "door_open")
+
+    def restore(self, state):
+        super(DoorCell, self).restore(state)
+        self.params["walkable"] = not self.state
+
     def on_positive(self):
         self.state = not self.default
-        self.params["walkable"] = not self.state
-        if self.state:
-            self.image = IMG["door_closed"]
-        else:
-            self.image = IMG["door_open"]
+        self.set_walkable(not self.state)
+        self.image = self.texture(self.state)
 
     def on_negative(self):
         self.state = self.default
-        self.params["walkable"] = not self.state
-        if self.state:
-            self.image = IMG["door_closed"]
-        else:
-            self.image = IMG["door_open"]
+        self.set_walkable(not self.state)
+        self.image = self.texture(self.state)
 
 
 class DispenserCell(Cell):          # Класс клетки раздатчика. Абстрактен сам по себе
@@ -606,6 +1214,10 @@ class DispenserCell(Cell):          # Класс клетки раздатчик
         """Вызывается для создания нового объекта. Если объект будет "жив", то выкинет исключение"""
         self.item.create(self.field_pos)
 
+    def kill(self):
+        super(DispenserCell, self).kill()
+        self.item.recycle()     # Убранный с поля предмет без раздатчика никому не нужен
+
     def on_item_death(self):
         """Событие клетки, срабатывает, когда предмет уничтожается"""
         pass
@@ -613,10 +1225,10 @@ class DispenserCell(Cell):          # Класс клетки раздатчик
 
 class CubeDispenserCell(DispenserCell):     # Раздатчик кубика. При положительном сигнале попытается создать куб
     def __init__(self, auto_new_cube=True, auto_first_cube=True):
-        super(CubeDispenserCell, self).__init__(Cube((level_main.all_sprites, level_main.takeable_group)),
+        super(CubeDispenserCell, self).__init__(Cube.Get(),
                                                 auto_new=auto_new_cube,
                                                 auto_first=auto_first_cube,
-                                                image=IMG["cube_dispenser"])
+                                                image=TEXTURES.get("cube_dispenser"))
 
     def on_positive(self):
         if self.item.alive():
@@ -626,6 +1238,9 @@ class CubeDispenserCell(DispenserCell):     # Раздатчик кубика. 
     def on_negative(self):
         self.on_positive()
 
+    def dormant(self):          # Пока куб на поле или в руках, раздатчик должен о нем помнить
+        return super(CubeDispenserCell, self).dormant() and not self.item.alive()
+
     def on_item_death(self):
         if self.auto_new:
             self.on_positive()
@@ -633,7 +1248,7 @@ class CubeDispenserCell(DispenserCell):     # Раздатчик кубика. 
 
 class PressureButtonCell(Cell):     # Нажимная клетка. Посылает + если на ней стоит игрок или предмет
     def __init__(self):
-        super(PressureButtonCell, self).__init__(IMG["pressure_button_deactivated"])
+        super(PressureButtonCell, self).__init__(TEXTURES.get("pressure_button_deactivated"))
         self.standing = False
         self.takeable_lying = False
 
@@ -653,56 +1268,59 @@ class PressureButtonCell(Cell):     # Нажимная клетка. Посыл
         self.takeable_lying = False
         self.check()
 
+    def texture(self, state):
+        return TEXTURES.get("pressure_button_activated" if state else "pressure_button_deactivated")
+
+    def dormant(self):
+        return super(PressureButtonCell, self).dormant() and not self.standing
+
     def check(self):        # Проверка того, лежит ли что-нибудь на клетке
-        if self.standing or self.takeable_lying:
-            self.image = IMG["pressure_button_activated"]
-            self.state = True
-        else:
-            self.image = IMG["pressure_button_deactivated"]
-            self.state = False
+        pressed = self.standing or self.takeable_lying
+        if pressed != self.state:   # Смена изображения перерисовывает клетку, см. Cell.image
+            self.state = pressed
+            self.image = self.texture(pressed)
         self.send()
 
 
 class FizzlerCell(Cell):    # Рассеиватель. Если предмет "попадает" на клетку, то он уничтожается.
     def __init__(self, active=True):
-        super(FizzlerCell, self).__init__(IMG["fizzler"])
+        super(FizzlerCell, self).__init__(self.texture(active))
         self.state = self.default = active
 
     def on_stand(self):
         if self.state and level_main.player.hold is not None:
             level_main.player.release().die()
 
+    def texture(self, state):
+        return TEXTURES.get("fizzler" if state else "door_open")
+
     def on_positive(self):
         self.state = not self.default
-        if self.state:
-            self.image = IMG["fizzler"]
-        else:
-            self.image = IMG["door_open"]
+        self.image = self.texture(self.state)
 
     def on_negative(self):
         self.state = self.default
-        if self.state:
-            self.image = IMG["fizzler"]
-        else:
-            self.image = IMG["door_open"]
+        self.image = self.texture(self.state)
 
 
 class InfoCell(Cell):       # Информационная клетка. Содержит всякий текст
     def __init__(self):
-        super(InfoCell, self).__init__(IMG["info"])
+        super(InfoCell, self).__init__(TEXTURES.get("info"))
         self.text = ""
         self.params["activatable"] = True
 
     def on_activation(self):
+        if level_main.headless:
+            return
         it = GTextPopup(level_main.screen, self.text)
         if it.main() == 1:
             level_main.exit_code = 1
-        pass
+        level_main.invalidate()
 
 
 class ExitCell(Cell):       # Когда на клетку наступает игрок, он покидает уровень
     def __init__(self):
-        super(ExitCell, self).__init__(IMG["exit"])
+        super(ExitCell, self).__init__(TEXTURES.get("exit"))
 
     def on_stand(self):
         level_main.exit_code = -1000    # that means you won
@@ -710,21 +1328,99 @@ class ExitCell(Cell):       # Когда на клетку наступает и
             action_socket["PLAYER_WALK"] = False
 
 
+CELL_TYPES = {      # Символ в файле уровня -> функция создания клетки
+    " ": perform(EmptyCell),
+    "*": perform(WallCell),
+    "B": perform(EButtonCell),
+    "d": perform(DoorCell, False),
+    "D": perform(DoorCell, True),
+    "C": perform(CubeDispenserCell),
+    "_": perform(PressureButtonCell),
+    "F": perform(FizzlerCell, True),
+    "f": perform(FizzlerCell, False),
+    "I": perform(InfoCell),
+    "!": perform(ExitCell)
+}
+PLAIN_CELLS = " *"      # Клетки без поведения. В поле хранятся только кодом, см. GLevel.FieldMatrix
+BEHAVIOUR_CELLS = re.compile(b"[^" + re.escape(PLAIN_CELLS.encode("ascii")) + b"]")
+
+
+class GPool:
+    """Свободные объекты для повторного использования. Держит не больше limit штук, лишние
+    достаются сборщику мусора. Привести объект в исходное состояние должен тот, кто его возвращает"""
+    __slots__ = ("free", "limit")
+
+    def __init__(self, limit=POOL_LIMIT):
+        self.free = []
+        self.limit = limit
+
+    def __len__(self):
+        return len(self.free)
+
+    def get(self):              # Свободный объект или None
+        return self.free.pop() if self.free else None
+
+    def put(self, obj) -> bool:
+        """Вернуть объект. False - пул полон, объект не взят"""
+        if len(self.free) >= self.limit:
+            return False
+        self.free.append(obj)
+        return True
+
+
 class Takeable(GSprite):
-    """Класс подбираемого предмета. Сам по себе абстрактный, в чистом виде быть не должен."""
+    """Класс подбираемого предмета. Сам по себе абстрактный, в чистом виде быть не должен.
+    Изображение у каждого предмета свое (копия): прозрачность меняется у него, а не у общего IMG.
+    Предметы, которые больше никому не нужны, возвращаются в пул своего класса (recycle, см.
+    DispenserCell.kill) и выдаются снова через Get"""
+    pools = {}              # Класс предмета -> GPool
+
     def __init__(self, image=None, groups=()):
-        super(Takeable, self).__init__(image=image, groups=groups)
+        super(Takeable, self).__init__(image=image.copy() if image is not None else None, groups=groups)
         self.kill()
         self.field_pos = None
+        self.pooled = False
+
+    @classmethod
+    def Get(cls, *args):
+        """Предмет из пула класса, если пул пуст - новый (args передаются конструктору)"""
+        pool = Takeable.pools.get(cls)
+        item = pool.get() if pool is not None else None
+        if item is None:
+            return cls(*args)
+        item.pooled = False
+        return item
+
+    def stand(self, nx, ny):    # Группы с сеткой (takeable_group) перекладывают предмет по новому rect
+        super(Takeable, self).stand(nx, ny)
+        self.regrid()
+
+    def move(self, dx, dy):
+        super(Takeable, self).move(dx, dy)
+        self.regrid()
+
+    def regrid(self):
+        for group in self.groups():
+            if isinstance(group, GGridGroup):
+                group.reindex(self)
+
+    def recycle(self):
+        """Возвращает предмет, который не лежит на поле и не в руках, в пул. Обработчики,
+        навешанные владельцем (см. DispenserCell), снимаются"""
+        if self.pooled or self.alive():
+            return
+        self.__dict__.pop("on_death", None)
+        self.field_pos = None
+        self.pooled = Takeable.pools.setdefault(type(self), GPool()).put(self)
 
     def create(self, field_pos):
         """Создание предмета. Будет находиться на позиции, переданной в аргументе,
         визуально - на соответствующей клетке"""
         assert isinstance(field_pos, FieldPos)
-        self.add(level_main.takeable_group)
         self.field_pos = field_pos
-        self.stand(self.field_pos.get().x() + randint(0, self.field_pos.get().w() - self.w()),
-                   self.field_pos.get().y() + randint(0, self.field_pos.get().h() - self.h()))
+        self.stand(self.field_pos.get().x() + RNG.randint(0, self.field_pos.get().w() - self.w()),
+                   self.field_pos.get().y() + RNG.randint(0, self.field_pos.get().h() - self.h()))
+        self.add(level_main.takeable_group)     # После stand: группа запоминает положение
         self.image.set_alpha(255)
         field_pos.get().params["takeables"].append(self)
         self.on_create()
@@ -780,44 +1476,471 @@ class Cube(Takeable):       # Кубик. Внешне тоже кубик
         super(Cube, self).__init__(IMG["cube"], groups=groups)
 
 
+class GSignalNet:
+    """Распространение сигналов между клетками. Клетки задаются номерами в матрице поля, поэтому
+    сеть работает и для клеток, у которых сейчас нет объекта (см. GLevel.activate): такой получатель
+    создается только когда его сигнал действительно меняется. Для каждого получателя хранится
+    число включенных активаторов, так что смена состояния клетки стоит O(число её связей).
+    Сигналы копятся в течение кадра и доставляются разом в flush(). Циклы в связях запрещены"""
+    def __init__(self, mt, links):
+        self.mt = mt
+        self.connect = {}       # Активатор -> номера получателей
+        self.count = {}         # Получатель -> число активаторов
+        for sender, receiver in links:
+            self.connect.setdefault(sender, []).append(receiver)
+            self.count[receiver] = self.count.get(receiver, 0) + 1
+        self.check_cycles()
+        self.sent = {i: bool(mt.state[i]) for i in self.connect}    # Последнее отправленное состояние
+        self.recount()
+        self.signal = {i: self.active[i] == n for i, n in self.count.items()}   # Последний доставленный
+        self.pending = {}       # Получатели, ждущие flush (dict как упорядоченное множество)
+
+    def recount(self):          # Получатель -> число включенных активаторов, по sent
+        self.active = dict.fromkeys(self.count, 0)
+        for sender, receivers in self.connect.items():
+            if self.sent[sender]:
+                for receiver in receivers:
+                    self.active[receiver] += 1
+
+    def snapshot(self) -> bytes:
+        """Отправленное каждым активатором и доставленное каждому получателю, по байту"""
+        return bytes(self.sent.values()) + bytes(self.signal.values())
+
+    def restore(self, raw: bytes):
+        """Обратная к snapshot операция. Недоставленные сигналы отбрасываются"""
+        for i, index in enumerate(self.sent):
+            self.sent[index] = bool(raw[i])
+        for i, index in enumerate(self.signal, len(self.sent)):
+            self.signal[index] = bool(raw[i])
+        self.recount()
+        self.pending = {}
+
+    def check_cycles(self):
+        """Поиск цикла в связях (обход в глубину без рекурсии). Найденный цикл - ошибка уровня"""
+        color = {}              # Нет в словаре - не посещена, 1 - в обработке, 2 - обработана
+        for root in self.connect:
+            if root in color:
+                continue
+            color[root] = 1
+            stack = [(root, iter(self.connect[root]))]
+            while stack:
+                index, it = stack[-1]
+                nxt = next(it, None)
+                if nxt is None:
+                    color[index] = 2
+                    stack.pop()
+                elif color.get(nxt) == 1:
+                    path = ["{}, {}".format(*self.mt.pos(i)) for i, _ in stack]
+                    path.append("{}, {}".format(*self.mt.pos(nxt)))
+                    raise Exception("Cyclic cell connections: " + " -> ".join(path))
+                elif nxt not in color:
+                    color[nxt] = 1
+                    stack.append((nxt, iter(self.connect.get(nxt, ()))))
+
+    def send(self, index, state):
+        state = bool(state)
+        if index not in self.connect or self.sent[index] == state:
+            return
+        self.sent[index] = state
+        d = 1 if state else -1
+        for receiver in self.connect[index]:
+            self.active[receiver] += d
+            self.pending[receiver] = None
+
+    def flush(self):
+        """Доставка накопленных сигналов. Получатель сам может что-то отправить - это доставится тут же"""
+        while self.pending:
+            pending, self.pending = self.pending, {}
+            for receiver in pending:
+                signal = self.active[receiver] == self.count[receiver]
+                if signal != self.signal[receiver]:
+                    self.signal[receiver] = signal
+                    cell = self.mt.cell(receiver)
+                    if signal:
+                        cell.on_positive()
+                    else:
+                        cell.on_negative()
+
+
+class GLevelData:
+    """Скомпилированное описание уровня: коды клеток, связи и тексты. Объектов pygame не содержит,
+    поэтому хранится в памяти между запусками уровня и на диске в файле LEVEL_CACHE.
+    stamp - времена изменения исходников, digest - их хеш; по ним проверяется актуальность.
+    Целостность самого файла проверяется по длине и crc32 данных после заголовка"""
+    MAGIC = b"TRLV"
+    # Магия, версия, хеш, stamp, размер, начальная позиция, длина и crc32 данных
+    HEADER = struct.Struct("<4sH16sqqHHHHII")
+
+    def __init__(self, name, start_pos, rows, cols, codes: bytes, connections, info_text,
+                 stamp=None, digest=None):
+        self.name = name
+        self.start_pos = start_pos
+        self.rows = rows
+        self.cols = cols
+        self.codes = codes              # Символы клеток построчно, по байту на клетку
+        self.connections = connections  # [(r, c, r, c), ...] - от активатора к получателю
+        self.info_text = info_text      # [(r, c, текст), ...]
+        self.stamp = stamp
+        self.digest = digest
+        self.links = None               # Связи и тексты по номерам клеток, см. prepare
+        self.info = None
+
+    def prepare(self):
+        """Переводит связи и тексты из позиций в номера клеток, как их ждет GLevel.Build.
+        Не трогает pygame, поэтому может выполняться в фоне (см. GLevelLoader)"""
+        if self.links is not None:
+            return self
+        cols = self.cols
+        info = {}
+        for r, c, mes in self.info_text:
+            assert self.codes[r * cols + c] == ord("I")
+            info[r * cols + c] = mes
+        self.info = info
+        self.links = [(sr * cols + sc, er * cols + ec) for sr, sc, er, ec in self.connections]
+        return self
+
+    @classmethod
+    def Parse(cls, map_text: str, meta_text: str):
+        """Интерпретирует текстовый вид уровня (map.txt и meta.json)"""
+        rows = map_text.split("\n")
+        while rows and not rows[-1]:
+            rows.pop()
+        if not rows or any(len(row) != len(rows[0]) for row in rows):
+            raise AttributeError("Invalid matrix size")
+        for row in rows:
+            for c in row:
+                if c not in CELL_TYPES:
+                    raise KeyError("Unknown cell symbol {!r}".format(c))
+        meta_data = json.loads(meta_text)
+        start_pos = tuple(map(int, meta_data["start_pos"].split(",")))
+        connections = []
+        for start, end in meta_data["connections"].items():
+            sr, sc = map(int, start.split(","))
+            for p in end:
+                er, ec = map(int, p.split(","))
+                connections.append((sr, sc, er, ec))
+        info_text = []
+        for p, mes in meta_data["info_text"].items():
+            r, c = map(int, p.split(","))
+            assert rows[r][c] == "I"
+            info_text.append((r, c, mes))
+        return cls(meta_data["name"], start_pos, len(rows), len(rows[0]), "".join(rows).encode("ascii"),
+                   connections, info_text)
+
+    def dump(self) -> bytes:
+        """Двоичный вид: заголовок, коды клеток, список связей, тексты (длина + utf-8)"""
+        name = self.name.encode("utf-8")
+        out = [struct.pack("<H", len(name)), name, self.codes,
+               struct.pack("<I", len(self.connections)),
+               struct.pack("<{}H".format(4 * len(self.connections)), *itertools.chain(*self.connections)),
+               struct.pack("<H", len(self.info_text))]
+        for r, c, mes in self.info_text:
+            mes = mes.encode("utf-8")
+            out += [struct.pack("<HHI", r, c, len(mes)), mes]
+        payload = b"".join(out)
+        return self.HEADER.pack(self.MAGIC, LEVEL_CACHE_VERSION, self.digest, self.stamp[0], self.stamp[1],
+                                self.rows, self.cols, self.start_pos[0], self.start_pos[1],
+                                len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def Read(cls, raw: bytes):
+        """Обратная к dump операция. Для файла другой версии, не того формата, обрезанного или
+        испорченного вернет None"""
+        if len(raw) < cls.HEADER.size:
+            return None
+        magic, version, digest, st1, st2, rows, cols, sr, sc, size, crc = cls.HEADER.unpack_from(raw)
+        if magic != cls.MAGIC or version != LEVEL_CACHE_VERSION:
+            return None
+        at = cls.HEADER.size
+        if len(raw) - at != size or zlib.crc32(raw[at:]) != crc:
+            return None
+
+        def take(n):                # Следующие n байт; за концом данных - ошибка разбора
+            nonlocal at
+            if at + n > len(raw):
+                raise struct.error("compiled level is truncated")
+            at += n
+            return raw[at - n:at]
+
+        n, = struct.unpack("<H", take(2))
+        name = take(n).decode("utf-8")
+        codes = take(rows * cols)
+        n, = struct.unpack("<I", take(4))
+        flat = struct.unpack("<{}H".format(4 * n), take(8 * n))
+        connections = list(zip(flat[0::4], flat[1::4], flat[2::4], flat[3::4]))
+        n, = struct.unpack("<H", take(2))
+        info_text = []
+        for _ in range(n):
+            r, c, size = struct.unpack("<HHI", take(8))
+            info_text.append((r, c, take(size).decode("utf-8")))
+        if at != len(raw):
+            return None
+        return cls(name, (sr, sc), rows, cols, codes, connections, info_text, (st1, st2), digest)
+
+
+class GLevelSnapshot:
+    """Состояние идущего уровня, по которому его можно вернуть на место без пересборки (см.
+    GLevelExec.snapshot и restore): биты проходимости и состояния клеток, состояние сети сигналов,
+    нажимные плиты, на которых что-то лежит, клетка игрока и кубы. Куб задается номером клетки своего
+    раздатчика: cubes - пары (раздатчик, клетка) в том порядке, в котором кубы лежат на клетках,
+    held - раздатчик куба в руках игрока или -1"""
+    __slots__ = ("walk", "state", "signals", "lying", "player", "cubes", "held")
+
+    def __init__(self, walk: bytes, state: bytes, signals: bytes, lying, player, cubes, held=-1):
+        self.walk = walk
+        self.state = state
+        self.signals = signals
+        self.lying = tuple(lying)
+        self.player = player
+        self.cubes = tuple(cubes)
+        self.held = held
+
+    HEADER = struct.Struct("<IIIIIIi")      # Длины walk, state, signals, lying, cubes, клетка игрока, held
+
+    def dump(self) -> bytes:
+        """Двоичный вид: заголовок, байты клеток и сигналов, затем номера клеток (uint32)"""
+        return b"".join([self.HEADER.pack(len(self.walk), len(self.state), len(self.signals), len(self.lying),
+                                          len(self.cubes), self.player, self.held),
+                         self.walk, self.state, self.signals,
+                         struct.pack("<{}I".format(len(self.lying) + 2 * len(self.cubes)),
+                                     *self.lying, *itertools.chain(*self.cubes))])
+
+    @classmethod
+    def Read(cls, raw: bytes):
+        nw, ns, ng, nl, nc, player, held = cls.HEADER.unpack_from(raw)
+        at = cls.HEADER.size
+        walk, state, signals = raw[at:at + nw], raw[at + nw:at + nw + ns], raw[at + nw + ns:at + nw + ns + ng]
+        flat = struct.unpack_from("<{}I".format(nl + 2 * nc), raw, at + nw + ns + ng)
+        return cls(walk, state, signals, flat[:nl], player, zip(flat[nl::2], flat[nl + 1::2]), held)
+
+
+class GSave:
+    """Сохранение игры: номер уровня и, если игрок вышел посреди уровня, снимок этого уровня (см.
+    GLevelSnapshot) вместе с папкой и хешем уровня - к другому уровню или к измененному снимок не
+    подходит. Снимок хранится сжатым: почти все байты клеток в нем повторяются"""
+    MAGIC = b"TRSV"
+    HEADER = struct.Struct("<4sHH16sH")     # Магия, версия, номер уровня, хеш уровня, длина папки
+
+    def __init__(self, lvl, level=None, digest=None, snap=None):
+        self.lvl = lvl
+        self.level = level
+        self.digest = digest
+        self.snap = snap
+
+    def fits(self, level_folder, digest) -> bool:
+        """Подходит ли снимок к уровню"""
+        return self.snap is not None and self.level == level_folder and self.digest == digest
+
+    def dump(self) -> bytes:
+        level = (self.level or "").encode("utf-8")
+        snap = zlib.compress(self.snap.dump(), 1) if self.snap is not None else b""
+        header = self.HEADER.pack(self.MAGIC, SAVE_VERSION, self.lvl, self.digest or bytes(16), len(level))
+        return b"".join([header, level, snap])
+
+    @classmethod
+    def Read(cls, raw: bytes):
+        """Обратная к dump операция. Для файла другой версии или не того формата вернет None"""
+        if len(raw) < cls.HEADER.size:
+            return None
+        magic, version, lvl, digest, size = cls.HEADER.unpack_from(raw)
+        if magic != cls.MAGIC or version != SAVE_VERSION:
+            return None
+        at = cls.HEADER.size
+        level = raw[at:at + size].decode("utf-8")
+        snap = raw[at + size:]
+        if not snap:
+            return cls(lvl, level or None, digest)
+        return cls(lvl, level, digest, GLevelSnapshot.Read(zlib.decompress(snap)))
+
+    @classmethod
+    def Load(cls):
+        """Сохранение с диска. Если SAVE_FILE нет или он испорчен - номер уровня из старого
+        LEGACY_SAVE_FILE, если нет и его - начало игры"""
+        try:
+            with open(SAVE_FILE, "rb") as f:
+                save = cls.Read(f.read())
+            if save is not None:
+                return save
+            log("unknown save format", "Load", "save", level=WARNING)
+        except IOError:
+            pass
+        except (struct.error, zlib.error, UnicodeDecodeError):
+            log("broken " + SAVE_FILE, "Load", "save", level=WARNING)
+        try:
+            with open(LEGACY_SAVE_FILE, "r") as f:
+                return cls(int(f.read()))
+        except (IOError, ValueError):
+            log("no save file found", "Load", "save")
+            return cls(0)
+
+
+class GSaveWriter:
+    """Запись сохранений в фоновом потоке, чтобы кадр не ждал диска. Файл пишется атомарно: во
+    временный файл рядом, затем os.replace - после падения на диске остается старое или новое
+    сохранение целиком. Записи выполняются по очереди, в файле остается последняя"""
+    def __init__(self):
+        self.pool = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="GSaveWriter")
+
+    def write(self, path, dump):
+        """dump - функция, возвращающая байты файла. Вызывается уже в потоке записи"""
+        self.pool.submit(self.store, path, dump)
+
+    @staticmethod
+    def store(path, dump):      # Выполняется в потоке записи
+        tmp = path + ".tmp"
+        try:
+            raw = dump()
+            with open(tmp, "wb") as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            log("can't write {}: {}".format(path, e), "store", "save", level=WARNING)
+        except Exception:       # Иначе ошибка останется в Future потока, и сохранение пропадет молча
+            log("can't save {}:\n{}".format(path, traceback.format_exc()), "store", "save", level=ERROR)
+
+    def shutdown(self):
+        """Дожидается записи всех сохранений"""
+        self.pool.shutdown(wait=True)
+
+
+class GInputLog:
+    """Запись ввода игрока на уровне: команды (ключи GLevelExec.MOVES и "E") и выбор в паузе, каждое
+    с номером шага симуляции, к которому оно пришло. Вместе с зерном RNG этого хватает, чтобы повторить
+    игру без окна шаг в шаг (см. GLevelExec.replay_input). Хранится в двоичном виде: заголовок, имя
+    уровня, номера шагов (uint32) и коды событий (по байту)"""
+    MAGIC = b"TRIN"
+    HEADER = struct.Struct("<4sHIIHH")      # Магия, версия, зерно, последний шаг, шагов в секунду, длина имени
+    PAUSE = {0: "p", 1000: "r", -2000: "x", 1: "q"}     # Код выхода из паузы -> событие
+    RESUME = {event: ex for ex, event in PAUSE.items()}
+    QUIT = "q"                              # Закрытие окна
+
+    def __init__(self, level, seed, sim_rate, end=0, ticks=(), codes=b""):
+        self.level = level
+        self.seed = seed
+        self.sim_rate = sim_rate
+        self.end = end              # Шаг, на котором уровень завершился
+        self.ticks = array("I", ticks)
+        self.codes = bytearray(codes)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def append(self, tick, event):
+        self.ticks.append(tick)
+        self.codes.append(ord(event))
+
+    def event(self, i):
+        return chr(self.codes[i])
+
+    def dump(self) -> bytes:
+        name = self.level.encode("utf-8")
+        header = self.HEADER.pack(self.MAGIC, INPUT_LOG_VERSION, self.seed, self.end, self.sim_rate, len(name))
+        ticks = struct.pack("<I{}I".format(len(self.ticks)), len(self.ticks), *self.ticks)
+        return b"".join([header, name, ticks, bytes(self.codes)])
+
+    @classmethod
+    def Read(cls, raw: bytes):
+        """Разбор записи. None, если это не запись или она другой версии"""
+        if len(raw) < cls.HEADER.size:
+            return None
+        magic, version, seed, end, sim_rate, size = cls.HEADER.unpack_from(raw)
+        if magic != cls.MAGIC or version != INPUT_LOG_VERSION:
+            return None
+        at = cls.HEADER.size
+        level = raw[at:at + size].decode("utf-8")
+        at += size
+        n, = struct.unpack_from("<I", raw, at)
+        ticks = struct.unpack_from("<{}I".format(n), raw, at + 4)
+        at += 4 + 4 * n
+        return cls(level, seed, sim_rate, end, ticks, raw[at:at + n])
+
+    @classmethod
+    def Load(cls, path):
+        with open(path, "rb") as f:
+            rec = cls.Read(f.read())
+        if rec is None:
+            raise Exception("Not an input log: " + path)
+        return rec
+
+
 class GLevel(GSprite):
     """Класс игрвого клетчатого поля и уровня. Реализует расстановку клеток, также вычислению
     абсолютной позиции предмета в клетке, также генерацию уровня из текстового файла
     """
-    def __init__(self, level_name, start_pos, matrix=None, groups=()):
+    def __init__(self, level_name, start_pos, matrix=None, groups=(), links=None):
         super(GLevel, self).__init__(rectf=None, image=None, groups=groups)
+        self.changed = []       # Клетки, сменившие изображение с последнего кадра
+        self.chunks = {}        # (строка, столбец) чанка -> изображение его клеток
+        self.center = None      # Чанк, вокруг которого у клеток есть объекты (см. activate)
         self.name = level_name
         self.start_pos = start_pos
         self.mt_groups = groups
         if matrix is None:
-            log("Init without matrix", "__init__", "field")
-            self.mt = self.FieldMatrix(self, [[EmptyCell() for i in range(FIELD_WIDTH)]
-                                              for k in range(FIELD_HEIGHT)])
-            log("Matrix creation ended.", "__init__", "field")
+            log("Init without matrix", "__init__", "field", level=DEBUG)
+            matrix = self.FieldMatrix(None, size=(FIELD_HEIGHT, FIELD_WIDTH),
+                                      codes=b" " * FIELD_HEIGHT * FIELD_WIDTH)
+            log("Matrix creation ended.", "__init__", "field", level=DEBUG)
         else:
-            log("Init with matrix", "__init__", "field")
-            if isinstance(matrix, self.FieldMatrix):
-                self.mt = matrix
-            else:
-                self.mt = self.FieldMatrix(self, matrix)
-            for pos in self.mt:
-                pos.get().image = pg.transform.scale(pos.get().image, (CELL_SIZE, CELL_SIZE))
-                pos.get().setup(pos)
-            log("Matrix check and transform ended.", "__init__", "field")
+            log("Init with matrix", "__init__", "field", level=DEBUG)
+        if isinstance(matrix, self.FieldMatrix):
+            self.mt = matrix
+            self.mt._field = self
+        else:
+            self.mt = self.FieldMatrix(self, matrix)
+        for index, cell in self.mt.items():
+            if cell.image.get_size() != (CELL_SIZE, CELL_SIZE):
+                cell.image = pg.transform.scale(cell.image, (CELL_SIZE, CELL_SIZE))
+            cell.setup(self.FieldPos(*self.mt.pos(index)))
+        log("Matrix check and transform ended.", "__init__", "field", level=DEBUG)
 
         self.size = self.width, self.height = self.mt.size()
-        self.scale(self.width * CELL_SIZE, self.height * CELL_SIZE)
+        self.scale(self.mt.column_count() * CELL_SIZE, self.mt.row_count() * CELL_SIZE)
+        self.draw_cells()
+        if links is None:       # Связи заданы списками connect самих клеток
+            links = [(index, receiver.index) for index, cell in self.mt.items() for receiver in cell.connect]
+        self.signals = GSignalNet(self.mt, links)
 
     class FieldMatrix:
-        """Класс матрицы. Используется для упрощения доступа к клеткам и минимизации количества аргументов"""
-        def __init__(self, field, _list: list):
+        """Класс матрицы. Используется для упрощения доступа к клеткам и минимизации количества аргументов.
+        Хранит поле компактно: коды клеток (символы из CELL_TYPES), проходимость и состояния лежат
+        построчно в bytearray. Объект Cell создается при обращении к клетке (materialize) и может
+        быть убран обратно (demote), если всё состояние клетки помещается в эти биты.
+        Создается либо из списка списков клеток, либо из кодов (size, codes), словаря cells
+        (номер клетки -> Cell) для уже созданных клеток и текстов info (номер клетки -> текст)"""
+        def __init__(self, field, _list: list = None, size=None, codes=b"", cells=None, info=None):
             self._field = field
-            self._items = _list
-            if len(_list) == 0 or len(_list[0]) == 0:
+            if _list is not None:
+                if len(_list) == 0 or len(_list[0]) == 0:
+                    raise AttributeError("Invalid matrix size")
+                size = len(_list), len(_list[0])
+                codes = bytes(size[0] * size[1])
+                cells = {r * size[1] + c: cell for r, row in enumerate(_list) for c, cell in enumerate(row)}
+            self._rows, self._cols = size
+            if self._rows == 0 or self._cols == 0 or len(codes) != self._rows * self._cols:
                 raise AttributeError("Invalid matrix size")
+            self._cells = {} if cells is None else cells
+            self.info = {} if info is None else info
+            self.codes = bytearray(codes)
+            self._protos = {}       # Код -> образец клетки: проходимость и изображения клеток без объекта
+            walk_table, state_table = bytearray(256), bytearray(256)
+            for char, create in CELL_TYPES.items():
+                if char.encode("ascii") in self.codes:
+                    proto = self._protos[ord(char)] = create()
+                    walk_table[ord(char)] = bool(proto.params["walkable"])
+                    state_table[ord(char)] = bool(proto.state)
+                    proto.kill()    # Образец на поле не выходит: предмет раздатчика возвращается в пул
+            self.walk = bytearray(self.codes.translate(walk_table))
+            self.state = bytearray(self.codes.translate(state_table))
+            for index, cell in self._cells.items():
+                self.walk[index] = bool(cell.params["walkable"])
+                self.state[index] = bool(cell.state)
 
         class MatrixPos:
             """Класс позиции в матрице. Содержит также информацию об уровне, который содержит эту позицию"""
+            __slots__ = ("_field", "_mt", "_r", "_c")
+
             def __init__(self, field, *p):
                 assert isinstance(field, GLevel)
                 self._field = field
@@ -875,37 +1998,111 @@ class GLevel(GSprite):
 
         def __getitem__(self, item) -> Cell:
             if isinstance(item, tuple):
-                return self._items[item[0]][item[1]]
+                index = item[0] * self._cols + item[1]
             elif isinstance(item, self.MatrixPos):
-                return item.get()
+                index = item.r() * self._cols + item.c()
             else:
                 raise KeyError("Key type must be tuple or FieldPos object")
+            return self.cell(index)
 
         def __setitem__(self, key, value: Cell):
             if isinstance(key, tuple):
-                self._items[key[0]][key[1]] = value
+                index = key[0] * self._cols + key[1]
             elif isinstance(key, self.MatrixPos):
-                key.set(value)
+                index = key.r() * self._cols + key.c()
             else:
                 raise KeyError("Key type must be tuple or FieldPos object")
+            self._cells[index] = value
+            self.walk[index] = bool(value.params["walkable"])
+            self.state[index] = bool(value.state)
+
+        def cell(self, index) -> Cell:      # Клетка по номеру, объект создается при необходимости
+            cell = self._cells.get(index)
+            return cell if cell is not None else self.materialize(index)
+
+        def materialize(self, index) -> Cell:
+            """Создание объекта для клетки, до этого хранившейся только кодом и битами"""
+            r, c = divmod(index, self._cols)
+            cell = self._cells[index] = CELL_TYPES[chr(self.codes[index])]()
+            cell.restore(self.state[index])
+            if index in self.info:
+                cell.text = self.info[index]
+            cell.stand(*self._field.place((r, c)))
+            cell.setup(self._field.FieldPos(r, c))
+            return cell
+
+        def demote(self, index):
+            """Убирает объект клетки, если её состояние целиком хранится в матрице (см. Cell.dormant).
+            Клетки без кода (поле из списка объектов) не убираются. Возвращает, убран ли объект"""
+            cell = self._cells.get(index)
+            if cell is None or self.codes[index] not in self._protos or not cell.dormant():
+                return False
+            del self._cells[index]
+            cell.kill()
+            return True
+
+        def reset(self, walk: bytes, state: bytes):
+            """Убирает объекты всех клеток с кодом, какое бы состояние у них ни было, и записывает
+            биты проходимости и состояния. Объекты создадутся заново при обращении"""
+            for index in [i for i in self._cells if self.codes[i] in self._protos]:
+                self._cells.pop(index).kill()
+            self.walk[:] = walk
+            self.state[:] = state
+
+        def peek(self, r, c):
+            """Клетка на позиции: объект клетки с поведением (создается при необходимости) или
+            None для простой клетки, у которой объекта нет"""
+            index = r * self._cols + c
+            cell = self._cells.get(index)
+            if cell is None and chr(self.codes[index]) not in PLAIN_CELLS:
+                cell = self.materialize(index)
+            return cell
+
+        def walkable(self, r, c):
+            return 0 <= r < self._rows and 0 <= c < self._cols and self.walk[r * self._cols + c] == 1
+
+        def image(self, index) -> pg.Surface:
+            cell = self._cells.get(index)
+            if cell is not None:
+                return cell.image
+            return self._protos[self.codes[index]].texture(self.state[index])
+
+        def index(self, r, c):
+            return r * self._cols + c
+
+        def pos(self, index):
+            return divmod(index, self._cols)
+
+        def row(self, r) -> memoryview:     # Коды клеток строки r без копирования
+            return memoryview(self.codes)[r * self._cols:(r + 1) * self._cols]
+
+        def items(self):            # Пары (номер, клетка) для клеток, у которых есть объект
+            return self._cells.items()
+
+        def indices(self):          # Номера клеток, у которых есть объект
+            return self._cells.keys()
+
+        def cells(self):
+            return self._cells.values()
 
         def row_count(self):
-            return len(self._items)
+            return self._rows
 
         def column_count(self):
-            return len(self._items[0])
+            return self._cols
 
         def size(self):
             return self.row_count(), self.column_count()
 
         def __iter__(self):
-            """Возвращает итератор на клетки матрицы по порядку. Все клетки в матрице будут пройдены"""
-            return iter([self.MatrixPos(self._field, (i, k))
-                         for i in range(self.row_count())
-                         for k in range(self.column_count())])
+            """Возвращает итератор на клетки матрицы по порядку. Все клетки в матрице будут пройдены.
+            Позиции создаются по ходу обхода, общий список не строится"""
+            for i in range(self._rows):
+                for k in range(self._cols):
+                    yield self.MatrixPos(self._field, i, k)
 
         def __str__(self):
-            return ", \n".join(["[" + ", ".join(map(str, i)) + "]" for i in self._items])
+            return "\n".join(bytes(self.row(r)).decode("ascii", "replace") for r in range(self._rows))
 
         def __repr__(self):
             return str(self)
@@ -913,13 +2110,87 @@ class GLevel(GSprite):
     def FieldPos(self, r, c):       # Быстрая ссылка на класс позиции в матрице
         return self.FieldMatrix.MatrixPos(self, (r, c))
 
+    def on_cell_changed(self, cell):    # Вызывается клеткой при смене изображения
+        self.changed.append(cell)
+        self.bake_cell(cell)
+
+    def activate(self, r, c):
+        """Держит объекты клеток только рядом с позицией (r, c) - игроком, за которым следит камера.
+        В чанках (CHUNK_SIZE x CHUNK_SIZE клеток) не дальше ACTIVE_CHUNKS от него объекты есть у всех
+        клеток с поведением, дальше - только у клеток с временным состоянием (см. Cell.dormant).
+        Изображения дальних чанков тоже освобождаются. Работает, только когда игрок сменил чанк"""
+        center = r // CHUNK_SIZE, c // CHUNK_SIZE
+        if center == self.center:
+            return
+        self.center = center
+
+        def far(cr, cc):
+            return max(abs(cr - center[0]), abs(cc - center[1])) > ACTIVE_CHUNKS
+
+        cols = self.mt.column_count()
+        for index in [i for i in self.mt.indices() if far(i // cols // CHUNK_SIZE, i % cols // CHUNK_SIZE)]:
+            self.mt.demote(index)
+        for key in [k for k in self.chunks if far(*k)]:
+            del self.chunks[key]
+        c0 = max(0, (center[1] - ACTIVE_CHUNKS) * CHUNK_SIZE)
+        c1 = min(cols, (center[1] + ACTIVE_CHUNKS + 1) * CHUNK_SIZE)
+        for row in range(max(0, (center[0] - ACTIVE_CHUNKS) * CHUNK_SIZE),
+                         min(self.mt.row_count(), (center[0] + ACTIVE_CHUNKS + 1) * CHUNK_SIZE)):
+            for m in BEHAVIOUR_CELLS.finditer(self.mt.codes, row * cols + c0, row * cols + c1):
+                self.mt.cell(m.start())
+
+    def reset(self, walk: bytes, state: bytes):
+        """Возвращает клетки к битам walk и state (см. FieldMatrix.reset). Изображения чанков
+        и объекты клеток у игрока создаются заново, см. activate"""
+        self.mt.reset(walk, state)
+        self.chunks.clear()
+        self.changed.clear()
+        self.center = None
+
+    def draw(self, surface: pg.Surface, offset, area: pg.Rect):
+        """Рисует клетки поля, попадающие в прямоугольник area на surface, со смещением камеры offset.
+        Поле рисуется по чанкам, изображение чанка создается при первой отрисовке"""
+        size = CHUNK_SIZE * CELL_SIZE
+        x, y = self.rect.x + offset[0], self.rect.y + offset[1]
+        rows = range(max(0, (area.top - y) // size),
+                     min((self.mt.row_count() - 1) // CHUNK_SIZE, (area.bottom - 1 - y) // size) + 1)
+        cols = range(max(0, (area.left - x) // size),
+                     min((self.mt.column_count() - 1) // CHUNK_SIZE, (area.right - 1 - x) // size) + 1)
+        surface.blits([(self.chunk(cr, cc), (x + cc * size, y + cr * size))
+                       for cr in rows for cc in cols], False)
+
+    def chunk(self, cr, cc) -> pg.Surface:
+        image = self.chunks.get((cr, cc))
+        return image if image is not None else self.bake_chunk(cr, cc)
+
+    def bake_chunk(self, cr, cc) -> pg.Surface:
+        """Отрисовывает клетки чанка в одно изображение. Дальше при смене изображения клетки
+        перерисовывается только её участок"""
+        rows = range(cr * CHUNK_SIZE, min((cr + 1) * CHUNK_SIZE, self.mt.row_count()))
+        cols = range(cc * CHUNK_SIZE, min((cc + 1) * CHUNK_SIZE, self.mt.column_count()))
+        image = self.chunks[cr, cc] = pg.Surface((len(cols) * CELL_SIZE, len(rows) * CELL_SIZE))
+        image.fill(COLORS["background"])
+        image.blits([(self.mt.image(self.mt.index(r, c)),
+                      ((c - cols.start) * CELL_SIZE, (r - rows.start) * CELL_SIZE))
+                     for r in rows for c in cols], False)
+        return image
+
+    def bake_cell(self, cell):
+        r, c = cell.field_pos.pos()
+        image = self.chunks.get((r // CHUNK_SIZE, c // CHUNK_SIZE))
+        if image is not None:
+            x, y = c % CHUNK_SIZE * CELL_SIZE, r % CHUNK_SIZE * CELL_SIZE
+            image.fill(COLORS["background"], (x, y, CELL_SIZE, CELL_SIZE))
+            image.blit(cell.image, (x, y))
+
     def set_view(self, pos):        # Передвижение своего спрайта в позицию
-        log("Replacing my view...", "set_view", "field")
+        log("Replacing my view...", "set_view", "field", level=DEBUG)
         self.stand(*pos)
+        self.draw_cells()
 
-    def draw_cells(self):
-        for pos in self.mt:
-            pos.get().stand(*self.place(pos.pos()))
+    def draw_cells(self):           # Расстановка клеток по местам. Вызывается только при перемещении поля
+        for index, cell in self.mt.items():
+            cell.stand(*self.place(self.mt.pos(index)))
         # for r, row in enumerate(self.mt):
         #     for c, item in enumerate(row):
         #         item.stand(*self.place((c, r)))
@@ -928,30 +2199,60 @@ class GLevel(GSprite):
         x, y = self.pos()
         return x + point[1] * CELL_SIZE, y + point[0] * CELL_SIZE
 
+    compiled = {}           # Папка уровня -> GLevelData. Повторный запуск уровня не читает диск
+    compile_lock = threading.Lock()     # Compile вызывается и из потока GLevelLoader
+
     @staticmethod
-    def Load(path_to_folder, *groups):
-        """Интерпретирует текстовый вид уровня в сам уровень с помощью имеющегося синтаксиса
-        TODO документация по синтаксису"""
+    def Compile(path_to_folder) -> GLevelData:
+        """Возвращает скомпилированный уровень. Берется из памяти или из файла LEVEL_CACHE, если
+        исходники с тех пор не менялись (сначала сверяется время изменения, затем хеш), иначе
+        уровень разбирается заново, а файл LEVEL_CACHE перезаписывается"""
+        with GLevel.compile_lock:
+            return GLevel.__compile(path_to_folder)
+
+    @staticmethod
+    def __compile(path_to_folder) -> GLevelData:
         map_file = os.path.join(path_to_folder, "map.txt")
         meta_file = os.path.join(path_to_folder, "meta.json")
-        with open(map_file, "r") as fmap, open(meta_file, "r") as fmeta:
-            data_map = fmap.read().split("\n")
-            meta_data = json.loads(fmeta.read(), encoding="UTF-16")
-            name = meta_data["name"]
-            st_pos = map(int, meta_data["start_pos"].split(","))
-            mt = [[GetCell(c) for c in row] for row in data_map]
-            for start, end in meta_data["connections"].items():
-                start = list(map(int, start.split(",")))
-                end = [tuple(map(int, i.split(","))) for i in end]
-                for p in end:
-                    mt[start[0]][start[1]].connect.append(mt[p[0]][p[1]])
-                    mt[p[0]][p[1]].activators.append(mt[start[0]][start[1]])
-            for p, mes in meta_data["info_text"].items():
-                p = list(map(int, p.split(",")))
-                assert isinstance(mt[p[0]][p[1]], InfoCell)
-                mt[p[0]][p[1]].text = mes
-
-        return GLevel(name, st_pos, mt, *groups)
+        cache_file = os.path.join(path_to_folder, LEVEL_CACHE)
+        stamp = (os.stat(map_file).st_mtime_ns, os.stat(meta_file).st_mtime_ns)
+        data = GLevel.compiled.get(path_to_folder)
+        if data is not None and data.stamp == stamp:
+            return data
+        try:
+            with open(cache_file, "rb") as f:
+                data = GLevelData.Read(f.read())
+        except (IOError, struct.error, UnicodeDecodeError):
+            data = None
+        if data is None or data.stamp != stamp:
+            with open(map_file, "rb") as fmap, open(meta_file, "rb") as fmeta:
+                raw_map, raw_meta = fmap.read(), fmeta.read()
+            digest = hashlib.md5(raw_map + b"\0" + raw_meta).digest()
+            if data is None or data.digest != digest:
+                log("Compiling level", "Compile", "field")
+                data = GLevelData.Parse(raw_map.decode("utf-8").replace("\r", ""), raw_meta.decode("utf-8"))
+            data.stamp, data.digest = stamp, digest
+            try:
+                with open(cache_file, "wb") as f:
+                    f.write(data.dump())
+            except IOError:
+                log("can't write " + cache_file, "Compile", "field", level=WARNING)
+        GLevel.compiled[path_to_folder] = data
+        return data
+
+    @staticmethod
+    def Build(data: GLevelData, *groups):
+        """Создание уровня по скомпилированному описанию. Объекты клеток создаются здесь,
+        поэтому вызывать только из главного потока, когда level_main - строящийся уровень"""
+        data.prepare()
+        mt = GLevel.FieldMatrix(None, size=(data.rows, data.cols), codes=data.codes, info=dict(data.info))
+        return GLevel(data.name, data.start_pos, mt, *groups, links=data.links)
+
+    @staticmethod
+    def Load(path_to_folder, *groups):
+        """Интерпретирует текстовый вид уровня в сам уровень с помощью имеющегося синтаксиса
+        (см. GLevelData.Parse, CELL_TYPES). Разобранный уровень кешируется, см. Compile"""
+        return GLevel.Build(GLevel.Compile(path_to_folder), *groups)
 
 
 FieldPos = GLevel.FieldMatrix.MatrixPos
@@ -965,16 +2266,26 @@ class Player(GSprite):
         self.field_pos = field_pos
         self.hold = None
 
+    def stand(self, nx, ny):    # Предмет в руках ходит вместе с игроком, по центру
+        super(Player, self).stand(nx, ny)
+        if self.hold is not None:
+            self.centrify(self.hold)
+
+    def move(self, dx, dy):
+        super(Player, self).move(dx, dy)
+        if self.hold is not None:
+            self.centrify(self.hold)
+
     def change_cell(self, dr, dc):
         r, c = self.field_pos.pos()
         nr = r + dr
         nc = c + dc
         nx, ny = self.field.place((nr, nc))
-        if self.field.mt[nr, nc].params["walkable"]:
+        if self.field.mt.walkable(nr, nc):
             act = GAction("PLAYER_WALK".format(str(nr), str(nc)), lambda: None)
             # Создается экземпляр GAction с пустой функцией
             act.action = concat(GSpriteMoveAnimation(self, nx - self.pos()[0], ny - self.pos()[1],
-                                                     5, on_end=act.socket_receive).exec,
+                                                     WALK_TIME, on_end=act.socket_receive).exec,
                                 perform(self.set_field_pos, nr, nc))
             # Пустая функция заменяется на:
             #   1) Запустить анимацию, после окончания очистить сокет "PLAYER_WALK"
@@ -982,17 +2293,21 @@ class Player(GSprite):
             act.exec()
 
     def set_field_pos(self, nr, nc):    # Присвоение позиции на поле, с прожатием сигналов комнат
-        self.field_pos.get().on_leave()
+        cell = self.field.mt.peek(*self.field_pos.pos())
+        if cell is not None:
+            cell.on_leave()
         self.field_pos.stand(nr, nc)
-        self.field_pos.get().on_stand()
+        cell = self.field.mt.peek(nr, nc)
+        if cell is not None:
+            cell.on_stand()
 
     def release(self) -> Takeable:      # Выкинуть предмет, который держит.
         if self.hold is None:
             raise Exception("Trying to release object while nothing is holding")
         self.field_pos.get().params["takeables"].append(self.hold)
         self.hold.field_pos = self.field_pos.copy()
-        self.hold.stand(self.field_pos.get().x() + randint(0, self.field_pos.get().w() - self.hold.w()),
-                        self.field_pos.get().y() + randint(0, self.field_pos.get().h() - self.hold.h()))
+        self.hold.stand(self.field_pos.get().x() + RNG.randint(0, self.field_pos.get().w() - self.hold.w()),
+                        self.field_pos.get().y() + RNG.randint(0, self.field_pos.get().h() - self.hold.h()))
 
         level_main.takeable_group.add(self.hold)
         level_main.player_group.remove(self.hold)
@@ -1000,36 +2315,63 @@ class Player(GSprite):
         self.hold = None
         self.field_pos.get().on_cube_set()
         if len(self.field_pos.get().params["takeables"]) > 2:
-            log("too many takeables at once", "change_cell", "WARNING")
+            log("too many takeables at once", "change_cell", "WARNING", level=WARNING)
         return _
 
 
 class GLevelExec(GPygameMachine):
     """Класс Main, занимающийся исполнением уровней. Пока игра содержит лишь один уровень
     - вызывается по умолчанию. Содержит очередь функций, счетчик цикла, а также группы спрайтов"""
-    def __init__(self, screen, level_folder, *args):
+    MOVES = {"U": (-1, 0), "L": (0, -1), "D": (1, 0), "R": (0, 1)}
+    KEYS = {pg.K_UP: "U", pg.K_LEFT: "L", pg.K_DOWN: "D", pg.K_RIGHT: "R", pg.K_e: "E"}
+
+    def __init__(self, screen, level_folder, *args, dirty_rects=False, script=None, max_ticks=None,
+                 record=None, replay=None, autosave=None):
         self.file = level_folder
         self.screen = screen
         self.args = args
+        self.dirty_mode = dirty_rects   # Перерисовывать только изменившиеся участки экрана
+        if script is not None:
+            # Без окна: команды (символы из MOVES, "E" и "." - пропуск) берутся из script
+            self.headless = True
+            self.fps = 0
+            self.script = iter(script)
+        self.max_ticks = max_ticks
+        self.record = record            # Папка, куда сохраняется запись ввода (GInputLog) после уровня
+        self.replay = replay            # Запись, ввод из которой повторяется без окна
+        if replay is not None:
+            self.headless = True
+            self.fps = 0
+            self.sim_rate = replay.sim_rate
+        self.autosave = autosave        # Функция, получающая снимок уровня раз в AUTOSAVE_TIME секунд
+        self.resume = None              # GSave, с которого продолжить уровень (задается перед main)
+        self.data = None                # Подготовленный уровень (GLevelLoader), иначе собирается в start
+        self.final = None               # Снимок при выходе с непройденного уровня
+        self.pause = None               # Машина паузы, создается при первой паузе
 
     class Pause(GPygameMachine):
-        """Класс машины, которая запускается, имитируя "Паузу" в игре."""
+        """Класс машины, которая запускается, имитируя "Паузу" в игре. Создается один раз на уровень
+        (GLevelExec.pause): кнопки и поверхности при следующих паузах используются снова"""
         def __init__(self, screen: pg.Surface):
             self.screen = screen
-
-        def start(self):
-            self.bg = pg.display.get_surface().copy()
-            self.bg.set_alpha(128)
-            it = pg.Surface(self.screen.get_size(), flags=pg.SRCALPHA)
-            it.fill((0, 0, 0, 192))
-            self.bg.blit(it, (0, 0))
-
+            self.bg = None
+            self.shade = pg.Surface(self.screen.get_size(), flags=pg.SRCALPHA)
+            self.shade.fill((0, 0, 0, 192))
             self.txt = TextButton(lambda: None, (350, 100, 100, 60), "Пауза")
             self.bns = [
                 TextButton(self.continue_, [300, 300, 200, 40], "Продолжить"),
                 TextButton(self.retry_, [300, 350, 200, 40], "Перезапуск"),
                 TextButton(self.exit_, [300, 400, 200, 40], "Выйти"),
             ]
+
+        def start(self):
+            display = pg.display.get_surface()
+            if self.bg is None or self.bg.get_size() != display.get_size():
+                self.bg = display.copy()
+                self.bg.set_alpha(128)
+            else:
+                self.bg.blit(display, (0, 0))
+            self.bg.blit(self.shade, (0, 0))
             self.sel = 0
 
         def continue_(self):
@@ -1045,7 +2387,7 @@ class GLevelExec(GPygameMachine):
             pass
 
         def handle_input(self):
-            for event in pg.event.get():
+            for event in self.events:
                 if event.type == pg.KEYDOWN:
                     if event.key == pg.K_ESCAPE:
                         self.continue_()
@@ -1064,73 +2406,337 @@ class GLevelExec(GPygameMachine):
             pg.draw.rect(self.screen, COLORS["foreground"], self.bns[self.sel].rect, 1)
 
     def start(self):
-        log("Started starting up...", "Start machine", "main")
+        log("Started starting up...", "Start machine", "main", level=DEBUG)
         self.exit_code = 0
-        self.queue = []
+        # Зерно зависит только от уровня, так что одинаковый ввод дает одинаковую игру
+        self.seed = self.replay.seed if self.replay is not None else zlib.crc32(self.file.encode("utf-8"))
+        RNG.seed(self.seed)
+        self.input_log = GInputLog(self.file, self.seed, self.sim_rate) if self.record is not None else None
+        self.replayed = 0           # Сколько событий записи уже выполнено, см. replay_input
+        self.queue = GScheduler(self.frame_budget)
         self.all_sprites = pg.sprite.Group()
         self.player_group = pg.sprite.Group()
         self.cell_group = pg.sprite.Group()
-        self.takeable_group = pg.sprite.Group()
+        self.takeable_group = GGridGroup()
 
+        if self.screen is None:
+            self.screen = pg.Surface(SCREEN_SIZE)
         self.window_size = self.window_width, self.window_height = self.screen.get_rect().size
+        action_socket["PLAYER_WALK"] = False    # Ходьба могла прерваться вместе с прошлым уровнем
 
         # self.screen = pg.display.set_mode(self.window_size, pg.FULLSCREEN)
 
-        self.field = GLevel.Load(self.file,
-                                 (self.all_sprites, self.cell_group))
+        data, self.data = self.data, None
+        if data is None:
+            data = GLevel.Compile(self.file)
+        self.digest = data.digest
+        self.field = GLevel.Build(data, (self.all_sprites, self.cell_group))
         self.field.set_view(((self.window_width - CELL_SIZE * self.field.width) // 2,
                              (self.window_height - CELL_SIZE * self.field.height) // 2))
         self.camera = GCamera()
         self.on_screen = pg.sprite.Group()
         self.player = Player(self.field.FieldPos(*self.field.start_pos), self.all_sprites, self.player_group)
         self.player.stand(*self.field.place((self.player.field_pos.r(), self.player.field_pos.c())))
+        self.field.activate(*self.player.field_pos.pos())
+
+        self.commands = collections.deque()     # Ждущие команды игрока, см. buffer
+        self.dirty = []             # Участки экрана, которые нужно вывести в present
+        self.drawn = {}             # Спрайт -> прямоугольник, в котором он был нарисован
+        self.view = None            # Смещение камеры при последней отрисовке
+        self.full_redraw = True
+        self.initial = self.snapshot()  # Для перезапуска из паузы, см. restore
+        self.saved_at = 0               # Шаг последнего автосохранения
+        if self.resume is not None:     # Продолжение с места выхода
+            if self.resume.fits(self.file, self.digest):
+                self.restore(self.resume.snap)
+            else:
+                log("save doesn't fit the level, starting over", "Start machine", "main", level=WARNING)
+            self.resume = None
 
-        log("Successfully started up", "Start machine", "main")
+        log("Successfully started up", "Start machine", "main", level=DEBUG)
 
     def quit(self):
-        log("Started quiting...", "Quit machine", "main")
+        log("Started quiting...", "Quit machine", "main", level=DEBUG)
+        # snapshot() сам доставляет сигналы, оставшиеся от команд из буфера
+        self.final = self.snapshot() if self.exit_code != -1000 else None
+        if self.input_log is not None:
+            self.input_log.end = self.g_cycle
+            path = os.path.join(self.record, "{}-{}.rec".format(os.path.basename(os.path.normpath(self.file)),
+                                                                time.strftime("%Y%m%d-%H%M%S")))
+            try:
+                with open(path, "wb") as f:
+                    f.write(self.input_log.dump())
+                log("Input saved to " + path, "Quit machine", "main")
+            except IOError as e:
+                log("Can't save input: {}".format(e), "Quit machine", "main", level=WARNING)
         # pg.quit()
-        log("Successfully quited", "Quit machine", "main")
+        log("Successfully quited", "Quit machine", "main", level=DEBUG)
 
     def handle_input(self):
-        for event in pg.event.get():
-            if event.type == pg.MOUSEBUTTONDOWN:
-                log(event)
-            if event.type == pg.KEYDOWN:
-                if event.key == pg.K_UP:
-                    self.player.change_cell(-1, 0)
-                elif event.key == pg.K_LEFT:
-                    self.player.change_cell(0, -1)
-                elif event.key == pg.K_DOWN:
-                    self.player.change_cell(1, 0)
-                elif event.key == pg.K_RIGHT:
-                    self.player.change_cell(0, 1)
-                elif event.key == pg.K_e:
-                    if self.player.hold is not None:
-                        self.player.release()
-                    elif self.player.field_pos.get().params["takeables"]:
-                        self.player.field_pos.get().params["takeables"][0].take()
-                    elif self.player.hold is None:
-                        r, c = self.player.field_pos.pos()
-                        self.field.mt[int(r), int(c)].on_activation()
+        if self.max_ticks is not None and self.g_cycle >= self.max_ticks:
+            self.exit_code = 0
+        if self.replay is not None:
+            self.replay_input()
+            return
+        if self.headless:
+            self.script_input()
+            return
+        if self.exit_code == 1:
+            self.apply_input(GInputLog.QUIT)
+        for event in self.events:
+            if event.type in REDRAW_EVENTS:     # Окно открыли или восстановили - частичной перерисовки мало
+                self.invalidate()
+            elif event.type == pg.KEYDOWN:
+                if event.key in self.KEYS:
+                    self.apply_input(self.KEYS[event.key])
                 elif event.key == pg.K_ESCAPE:
-                    it = self.Pause(self.screen)
-                    ex = it.main()
-                    if ex != 0:
-                        self.exit_code = ex
+                    if self.pause is None:
+                        self.pause = self.Pause(self.screen)
+                    ex = self.pause.main()
+                    self.invalidate()
+                    self.apply_input(GInputLog.PAUSE[ex])
+
+    def apply_input(self, event):
+        """Одно событие ввода в виде записи (см. GInputLog): команда, выбор в паузе или закрытие окна.
+        Живая игра и повтор записи проходят через эту функцию, поэтому команды из буфера выполняются
+        в одном и том же месте - сразу после каждого события"""
+        if event == GInputLog.QUIT:
+            self.exit_code = 1
+            self.note(event)
+        elif event in self.MOVES or event == "E":
+            self.buffer(event)
+        else:
+            self.paused(GInputLog.RESUME[event])
+        self.run_commands()
+
+    def paused(self, ex):
+        """Выбор в паузе: 0 - продолжить, 1000 - перезапуск, иначе выход с этим кодом"""
+        self.note(GInputLog.PAUSE[ex])
+        if ex == 1000:      # Перезапуск - на месте, по снимку начала уровня
+            self.restore(self.initial)
+        elif ex != 0:
+            self.exit_code = ex
+
+    def note(self, event):
+        """Запись события ввода вместе с текущим шагом, если уровень записывается"""
+        if self.input_log is not None:
+            self.input_log.append(self.g_cycle, event)
+
+    def buffer(self, cmd):
+        """Команда с клавиатуры. Пока игрок идет, она ждет в буфере (лишние нажатия отбрасываются)
+        и выполнится, как только ходьба закончится - см. run_commands"""
+        if len(self.commands) < INPUT_BUFFER:
+            self.commands.append(cmd)
+            self.note(cmd)
+
+    def replay_input(self):
+        """Ввод из записи. События выполняются в начале кадра с тем же номером шага, что и при записи,
+        а кадр без окна - ровно один шаг, так что игра повторяется точно. Кадры записи без шагов здесь
+        сливаются в один: между ними состояние уровня не менялось"""
+        rec = self.replay
+        while self.replayed < len(rec) and rec.ticks[self.replayed] <= self.g_cycle:
+            self.replayed += 1
+            self.apply_input(rec.event(self.replayed - 1))
+        # После решения выйти машина делает еще один шаг, и end записан уже после него
+        if self.replayed == len(rec) and self.g_cycle + 1 >= rec.end and self.exit_code == -1:
+            self.exit_code = 0
+
+    def run_commands(self):
+        while self.commands and not action_socket["PLAYER_WALK"]:
+            ex = self.exit_code
+            self.command(self.commands.popleft())
+            if self.exit_code == 1 and ex != 1:     # Окно закрыли из всплывающего текста (InfoCell)
+                self.note(GInputLog.QUIT)
+
+    def script_input(self):
+        """Ввод без окна. Пока игрок идет, следующая команда ждет. Когда команды кончаются,
+        уровень завершается"""
+        if action_socket["PLAYER_WALK"]:
+            return
+        cmd = next(self.script, None)
+        if cmd is None:
+            self.exit_code = 0
+        else:
+            self.command(cmd)
+
+    def command(self, cmd):
+        """Выполнение команды игрока: передвижение (ключи MOVES) или действие "E" """
+        if cmd in self.MOVES:
+            self.player.change_cell(*self.MOVES[cmd])
+        elif cmd == "E":
+            cell = self.field.mt.peek(*self.player.field_pos.pos())
+            if self.player.hold is not None:
+                self.player.release()
+            elif cell is not None and cell.params["takeables"]:
+                cell.params["takeables"][0].take()
+            elif cell is not None:
+                cell.on_activation()
+
+    def snapshot(self) -> GLevelSnapshot:
+        """Снимок состояния уровня. Недоставленные сигналы в снимок не попадают (см. GSignalNet.snapshot),
+        поэтому сначала доставляются"""
+        self.field.signals.flush()
+        mt = self.field.mt
+        hold = self.player.hold
+        owner = {cell.item: index for index, cell in mt.items()     # Куб -> клетка его раздатчика
+                 if isinstance(cell, CubeDispenserCell) and cell.item.alive()}
+        cubes = []
+        for index, cell in mt.items():
+            for item in cell.params["takeables"]:
+                # Раздатчик, выдавший куб заново, может числить его у себя дважды
+                if item is not hold and item in owner and mt.index(*item.field_pos.pos()) == index \
+                        and (owner[item], index) not in cubes:
+                    cubes.append((owner[item], index))
+        lying = [index for index, cell in mt.items()
+                 if isinstance(cell, PressureButtonCell) and cell.takeable_lying]
+        return GLevelSnapshot(bytes(mt.walk), bytes(mt.state), self.field.signals.snapshot(), lying,
+                              mt.index(*self.player.field_pos.pos()), cubes, owner.get(hold, -1))
+
+    def restore(self, snap: GLevelSnapshot):
+        """Возвращает уровень к снимку на месте: без чтения с диска и пересборки уровня. Прерывает
+        ходьбу, убирает все кубы и объекты клеток, а затем создает их заново по снимку"""
+        self.tweens.finish()        # Идущие перемещения завершаются сразу и освобождают сокеты
+        self.queue.clear()
+        self.commands.clear()
+        action_socket["PLAYER_WALK"] = False
+        items = list(self.takeable_group)
+        if self.player.hold is not None:
+            items.append(self.player.hold)
+        for item in items:
+            item.kill()
+            item.field_pos = None
+        self.player.hold = None
+        self.field.reset(snap.walk, snap.state)
+        self.field.signals.restore(snap.signals)
+        mt = self.field.mt
+        r, c = mt.pos(snap.player)
+        self.player.field_pos.stand(r, c)
+        self.player.stand(*self.field.place((r, c)))
+        self.field.activate(r, c)
+        for dispenser, index in snap.cubes:
+            mt.cell(dispenser).item.create(self.field.FieldPos(*mt.pos(index)))
+        if snap.held != -1:
+            item = self.player.hold = mt.cell(snap.held).item
+            item.field_pos = self.player.field_pos.copy()
+            item.image.set_alpha(255)
+            self.player.centrify(item)
+            self.player_group.add(item)
+        for index in snap.lying:
+            mt.cell(index).takeable_lying = True
+        cell = mt.peek(r, c)
+        if isinstance(cell, PressureButtonCell):
+            cell.standing = True
+        self.drawn.clear()
+        self.dirty = []
+        self.view = None
+        self.invalidate()
+
+    def invalidate(self):
+        """Требует полной перерисовки на следующем кадре. Вызывается после того, как экран
+        был занят другой машиной (пауза, всплывающий текст)"""
+        self.full_redraw = True
+
+    def update(self):
+        self.run_commands()         # Ходьба могла закончиться на этом шаге
+        self.field.activate(*self.player.field_pos.pos())
+        self.field.signals.flush()
+        # Автосохранение в конце шага, после доставки сигналов: так же, как при повторе записи без него
+        if self.autosave is not None and self.g_cycle - self.saved_at >= AUTOSAVE_TIME * self.sim_rate:
+            self.saved_at = self.g_cycle
+            self.autosave(self.snapshot())
 
     def manage_cycle(self):
-        pg.draw.rect(self.screen, COLORS["background"], pg.Rect(0, 0, self.window_width, self.window_height))
+        if self.headless:
+            self.field.changed.clear()
+            return
         self.camera.update(self.player, self.window_size)
-        self.camera.apply(self.player)
-        self.camera.apply(self.field)
-        for i in self.takeable_group:
-            self.camera.apply(i)
-        self.field.draw_cells()
-        # self.all_sprites.draw(self.screen)
-        self.cell_group.draw(self.screen)
-        self.takeable_group.draw(self.screen)
-        self.player_group.draw(self.screen)
+        if self.dirty_mode and not self.full_redraw and self.view == self.camera.offset():
+            self.dirty = self.collect_dirty()
+            for rect in self.dirty:
+                self.draw_area(rect)
+        else:
+            pg.draw.rect(self.screen, COLORS["background"],
+                         pg.Rect(0, 0, self.window_width, self.window_height))
+            self.field.draw(self.screen, self.camera.offset(), self.screen.get_rect())
+            self.draw_group(self.takeable_group)
+            self.draw_group(self.player_group)
+            if self.dirty_mode:
+                self.collect_dirty()
+                self.dirty = [self.screen.get_rect()]
+            self.view = self.camera.offset()
+            self.full_redraw = False
+        self.field.changed.clear()
+
+    def draw_group(self, group):    # Отрисовка группы спрайтов со смещением камеры (у сетки - только видимых)
+        if isinstance(group, GGridGroup):
+            group = group.query(self.camera.view(self.window_size, VIEW_MARGIN))
+        self.screen.blits([(spr.image, self.camera.apply(spr)) for spr in group], False)
+
+    def collect_dirty(self):
+        """Собирает участки экрана, изменившиеся с прошлого кадра: сменившие изображение клетки,
+        а также старые и новые положения подвижных спрайтов (игрок, предметы). Предметы берутся
+        только рядом с экраном, ушедшие с него считаются исчезнувшими"""
+        rects = [self.camera.apply(cell) for cell in self.field.changed]
+        seen = set()
+        view = self.camera.view(self.window_size, VIEW_MARGIN)
+        for spr in itertools.chain(self.takeable_group.query(view), self.player_group):
+            seen.add(spr)
+            old = self.drawn.get(spr)
+            new = self.camera.apply(spr)
+            if old != new:
+                if old is not None:
+                    rects.append(old)
+                rects.append(new)
+                self.drawn[spr] = new
+        for spr in [i for i in self.drawn if i not in seen]:    # Исчезнувшие спрайты
+            rects.append(self.drawn.pop(spr))
+        return rects
+
+    def draw_area(self, rect):      # Перерисовка одного участка экрана
+        self.screen.set_clip(rect)
+        self.screen.fill(COLORS["background"], rect)
+        self.field.draw(self.screen, self.camera.offset(), rect)
+        area = rect.move(-self.camera.dx, -self.camera.dy)
+        for group in (self.takeable_group.query(area), self.player_group):
+            for spr in group:
+                pos = self.camera.apply(spr)
+                if pos.colliderect(rect):
+                    self.screen.blit(spr.image, pos)
+        self.screen.set_clip(None)
+
+    def present(self):
+        if self.dirty_mode:
+            pg.display.update(self.dirty)
+        else:
+            pg.display.flip()
+
+
+class GLevelLoader:
+    """Фоновая подготовка уровней для GMain. Пока идет текущий уровень, поток загрузчика читает
+    и разбирает файлы следующего (GLevel.Compile) и переводит его связи в номера клеток. Готовый
+    GLevelData передается машине уровня (GLevelExec.data). Все, что касается pygame (изображения,
+    объекты клеток), делается уже в главном потоке, при старте уровня (GLevel.Build)"""
+    def __init__(self):
+        self.pool = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="GLevelLoader")
+        self.jobs = {}          # Папка уровня -> Future с GLevelData
+
+    @staticmethod
+    def load(level_folder) -> GLevelData:   # Выполняется в потоке загрузчика
+        return GLevel.Compile(level_folder).prepare()
+
+    def preload(self, level_folder):
+        """Поставить уровень в очередь на подготовку. Повторный вызов ничего не делает"""
+        if level_folder not in self.jobs:
+            self.jobs[level_folder] = self.pool.submit(self.load, level_folder)
+
+    def get(self, level_folder) -> GLevelData:
+        """Подготовленный уровень. Если подготовка еще идет - ждет её. Ошибки загрузки выбрасываются здесь"""
+        self.preload(level_folder)
+        return self.jobs.pop(level_folder).result()
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.jobs.clear()
 
 
 class GMain(GPygameMachine):
@@ -1138,39 +2744,61 @@ class GMain(GPygameMachine):
     def __init__(self, *args):
         self.args = args
         self.lvl = 0
+        self.resume = None      # GSave со снимком уровня self.lvl, если игрок вышел посреди него
 
     def bn_continue(self):
-        """Продолжение игры. При выходе прогресс сбрасывается TODO сохраняется"""
+        """Продолжение игры с сохраненного уровня, а если выход был посреди уровня - с того же места"""
         self.exec_level()
 
     def bn_new(self):
         self.lvl = 0
+        self.resume = None
         self.exec_level()
 
     def bn_demo(self):
         self.lvl = 0
+        self.resume = None
         self.lvls = [
-            GLevelExec(self.screen, os.path.join("data", "lvls", "demo"))
+            self.level_exec(os.path.join("data", "lvls", "demo"))
         ]
         self.exec_level()
 
+    def level_exec(self, level_folder):
+        """Создание машины уровня с учетом параметров запуска (--dirty - частичная перерисовка экрана,
+        --record <папка> - запись ввода на каждом уровне)"""
+        record = self.args[self.args.index("--record") + 1] if "--record" in self.args else None
+        if record is not None:
+            os.makedirs(record, exist_ok=True)
+        return GLevelExec(self.screen, level_folder, dirty_rects="--dirty" in self.args, record=record,
+                          autosave=self.autosave)
+
     def exec_level(self):
-        """Запуск уровня."""
+        """Запуск уровней по порядку, начиная с self.lvl, пока игрок их проходит. Пока идет
+        уровень, загрузчик готовит следующий. Перезапуск уровня делается в нем самом (GLevelExec.restore).
+        При выходе посреди уровня сохраняется его снимок, с которого потом можно продолжить"""
         global level_main
-        level_main = self.lvls[self.lvl]
-        ex = level_main.main()
-        level_main = None
-        if ex == 1:
-            self.exit_code = 1
-        elif ex == -1000:
+        while True:
+            level_main = self.lvls[self.lvl]
+            level_main.data = self.loader.get(level_main.file)
             if self.lvl < len(self.lvls) - 1:
-                self.lvl += 1
-                self.save()
-                self.exec_level()
-            else:
+                self.loader.preload(self.lvls[self.lvl + 1].file)
+            level_main.resume = self.resume
+            ex = level_main.main()
+            if level_main.final is not None:
+                self.resume = GSave(self.lvl, level_main.file, level_main.digest, level_main.final)
+            level_main = None
+            if ex == 1:
+                self.exit_code = 1
+            elif ex == -1000:
+                self.resume = None
+                if self.lvl < len(self.lvls) - 1:
+                    self.lvl += 1
+                    self.save()
+                    continue
                 self.won()
-        elif ex == 1000:
-            self.exec_level()
+            elif ex == -2000:
+                self.save()
+            return
 
     def won(self):
         th = GTextPopup(self.screen, "CONGRATULATIONS!!!!GG!!!")
@@ -1182,32 +2810,35 @@ class GMain(GPygameMachine):
         self.exit_code = 0
 
     def start(self):
-        try:
-            with open(os.path.join("user_files", "save_file.ini"), "r") as f:
-                self.lvl = int(f.read())
-        except IOError:
-            log("no save_file.ini found", "start", "main")
-            self.lvl = 0
+        self.writer = GSaveWriter()
+        save = GSave.Load()
+        self.lvl = save.lvl
+        self.resume = save if save.snap is not None else None
         pg.init()
         pg.font.init()
         pg.mouse.set_visible(False)
-        self.screen_size = self.screen_width, self.screen_height = 800, 600
+        self.screen_size = self.screen_width, self.screen_height = SCREEN_SIZE
         self.screen = pg.display.set_mode(self.screen_size)
+        pg.event.set_blocked(None)
+        pg.event.set_allowed(INPUT_EVENTS)
         self.lvls = [
-            GLevelExec(self.screen, os.path.join("data", "lvls", "1")),
-            GLevelExec(self.screen, os.path.join("data", "lvls", "2")),
-            GLevelExec(self.screen, os.path.join("data", "lvls", "3")),
-            GLevelExec(self.screen, os.path.join("data", "lvls", "4")),
+            self.level_exec(os.path.join("data", "lvls", "1")),
+            self.level_exec(os.path.join("data", "lvls", "2")),
+            self.level_exec(os.path.join("data", "lvls", "3")),
+            self.level_exec(os.path.join("data", "lvls", "4")),
         ]
         load_data()
+        self.loader = GLevelLoader()
+        for lvl in {0, min(self.lvl, len(self.lvls) - 1)}:     # Уровни для "Новая игра" и "Продолжить"
+            self.loader.preload(self.lvls[lvl].file)
         self.start_animation = GBrutalTextAnimation(self.screen,
-                                                    pg.font.SysFont("Comic Sans MS", 60),
+                                                    TEXTS.font("Comic Sans MS", 60),
                                                     "This game was made by Ilya Latypov (gang)")
         self.act = GAction("START_ANIMATION", self.start_animation.main)
         self.logo = GSprite(image=IMG["logo"])
         self.logo.stand(50, 50)
         self.on_screen = pg.sprite.Group(self.logo)
-        if self.lvl > 0:
+        if self.lvl > 0 or self.resume is not None:
             self.bns = [
                 TextButton(self.bn_continue, [10, 300, 780, 40], "Продолжить"),
             ]
@@ -1225,12 +2856,10 @@ class GMain(GPygameMachine):
             if self.act.exec() == 1:
                 self.exit_code = 1
 
-        self.queue.append(anim_start)
+        self.queue.schedule(anim_start)
 
     def handle_input(self):
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                self.exit_code = 0
+        for event in self.events:
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_UP and self.sel > 0:
                     self.sel -= 1
@@ -1248,32 +2877,102 @@ class GMain(GPygameMachine):
         pg.draw.rect(self.screen, COLORS["foreground"], self.bns[self.sel].rect, 1)
 
     def save(self):
-        with open(os.path.join("user_files", "save_file.ini"), "w") as f:
-            f.write(str(self.lvl))
+        """Сохранение в фоне (GSaveWriter): номер уровня и снимок, если уровень не закончен"""
+        save = self.resume if self.resume is not None else GSave(self.lvl)
+        self.writer.write(SAVE_FILE, save.dump)
+
+    def autosave(self, snap: GLevelSnapshot):
+        """Вызывается идущим уровнем (GLevelExec.autosave), на случай падения игры"""
+        self.resume = GSave(self.lvl, level_main.file, level_main.digest, snap)
+        self.save()
 
     def quit(self):
+        self.loader.shutdown()
+        TEXTS.clear()
         pg.quit()
         pg.font.quit()
         self.save()
+        self.writer.shutdown()
 
 
-def log(mes, sender=None, father=None, say=print):
-    """Функция логирования сообщений в консоль"""
-    if father is not None:
-        if sender is None:
-            sender = str(father).upper()
-        else:
-            sender = "{}/{}".format(str(father).upper(), str(sender))
-    if sender is not None:
-        mes = "[{}] ".format(str(sender)) + mes
-    say(mes)
+def log(mes, sender=None, father=None, say=None, level=INFO):
+    """Функция логирования сообщений в журнал (LOGGER). Записи ниже LOGGER.level почти ничего
+    не стоят. say - если задана, сообщение в виде "[FATHER/sender] mes" сразу передается ей (print)"""
+    if level >= LOGGER.level:
+        LOGGER.add(level, father, sender, mes)
+    if say is not None or level >= LOGGER.echo:
+        (say or print)(GLogger.text(father, sender, mes))
+
+
+def simulate(level_folder, script, max_ticks=None):
+    """Прохождение уровня без окна и без ограничения частоты кадров по списку команд script.
+    Возвращает код выхода (-1000 - уровень пройден) и количество прошедших кадров"""
+    global level_main
+    if not IMG:
+        load_data()
+    level_main = GLevelExec(None, level_folder, script=script, max_ticks=max_ticks)
+    try:
+        return level_main.main(), level_main.g_cycle
+    finally:
+        level_main = None
+
+
+def replay(path):
+    """Повтор записи ввода (GInputLog) без окна и без ограничения частоты кадров.
+    Возвращает код выхода и количество прошедших шагов"""
+    global level_main
+    rec = GInputLog.Load(path)
+    if not IMG:
+        load_data()
+    level_main = GLevelExec(None, rec.level, replay=rec)
+    try:
+        return level_main.main(), level_main.g_cycle
+    finally:
+        level_main = None
 
 
 def main(*args):
     global level_main
-    m = GMain(*args)
-    # me = GLevelExec("data/map.txt", *args)
-    return m.main()
+    # --trace <файл> - события в формате Chrome trace, --trace-stats <файл> - перцентили фаз кадра
+    TRACER.enabled = "--trace" in args or "--trace-stats" in args
+    # --fps <n> - ограничение отрисовки, --sim-rate <n> - шагов логики в секунду, --no-interpolate
+    if "--fps" in args:
+        GPygameMachine.fps = int(args[args.index("--fps") + 1])
+    if "--sim-rate" in args:
+        GPygameMachine.sim_rate = int(args[args.index("--sim-rate") + 1])
+    GPygameMachine.interpolate = "--no-interpolate" not in args
+    # --log <файл> - журнал в файл, --log-level debug|info|warning|error, --verbose - журнал и в консоль
+    if "--log-level" in args:
+        LOGGER.level = LOG_LEVELS[args[args.index("--log-level") + 1]]
+    if "--verbose" in args:
+        LOGGER.echo = LOGGER.level
+    if "--log" in args:
+        LOGGER.open(args[args.index("--log") + 1])
+    try:
+        if "--simulate" in args:    # --simulate <папка уровня> <команды>
+            i = args.index("--simulate")
+            ex, ticks = simulate(args[i + 1], args[i + 2])
+            log("exit code {} after {} ticks".format(ex, ticks), "simulate", "main", say=print)
+            return 0 if ex == -1000 else 1
+        if "--replay" in args:      # --replay <файл записи>
+            t = time.perf_counter()
+            ex, ticks = replay(args[args.index("--replay") + 1])
+            log("exit code {} after {} ticks in {:.2f}s".format(ex, ticks, time.perf_counter() - t),
+                "replay", "main", say=print)
+            return 0 if ex == -1000 else 1
+        m = GMain(*args)
+        # me = GLevelExec("data/map.txt", *args)
+        return m.main()
+    except Exception:
+        log(traceback.format_exc(), "main", "crash", level=ERROR)
+        LOGGER.dump(CRASH_LOG)
+        raise
+    finally:
+        LOGGER.close()
+        if "--trace" in args:
+            TRACER.dump(args[args.index("--trace") + 1])
+        if "--trace-stats" in args:
+            TRACER.dump_stats(args[args.index("--trace-stats") + 1])
 
 
 if __name__ == "__main__":
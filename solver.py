@@ -0,0 +1,454 @@
+"""Проверка проходимости уровней TRIAL. Перебирает в ширину состояния уровня: где игрок, что у него
+в руках, где кубы, какие кнопки нажаты и в каком состоянии двери и рассеиватели - пока не дойдет до
+выхода или не переберет все. Найденное решение переводится в команды игры и проверяется
+прохождением через main.simulate.
+
+    python solver.py [папки уровней] [--jobs 4] [--max-states 5000000] [--complete] [--no-verify]
+
+По умолчанию кубы кладутся только на нажимные плиты и простой пол (см. solve). Найденный так план
+кратчайший лишь среди таких решений, а не среди всех. Кратчайший по числу действий план дает только
+--complete, но он перебирает на порядок больше состояний и на уровнях 3-4 не укладывается в минуты.
+Даже обычный проход на больших уровнях небыстрый: уровень 3 - около 320 тыс. состояний и 15 с,
+уровень 4 - около 640 тыс. состояний и 35-45 с (одно ядро, --jobs 2 на нем не помогает)
+"""
+
+import os
+import sys
+import time
+import collections
+import concurrent.futures
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")   # Окно не нужно, уровень строится как в игре
+
+import main
+
+MOVES = main.GLevelExec.MOVES
+PARALLEL_FRONTIER = 5000        # С какого размера фронт поиска делится между процессами
+CHUNK = 1000                    # Состояний в одном задании процесса
+
+
+class GLevelModel:
+    """Правила уровня без pygame. Строится по GLevel: коды клеток, связи GSignalNet и начальные
+    биты состояния. Состояние упаковано в одно целое число:
+        игрок | номер куба в руках | положение каждого куба | кнопки | двери и рассеиватели
+    Куб принадлежит своему раздатчику (туда он возвращается), положение 0 - куба нет на поле
+    или он в руках. Нажимная плита включена, пока на ней игрок или куб, своих битов у нее нет. Два куба
+    на одну клетку не кладутся: плита в игре помнит лишь "что-то лежит", а E берет куб, положенный первым.
+    Несвязанные кнопки, плиты и двери ничего не меняют и в состояние не входят.
+
+    Поиск идет по сжатым состояниям. Клетку называем нейтральной, если на нее можно встать, ничего
+    не изменив (не плита, не выход, не рассеиватель, уничтожающий куб в руках). Все нейтральные
+    клетки, связанные между собой, для игрока равны - вместо позиции хранится наименьшая из них.
+    Простые клетки, которые всегда проходимы и нейтральны, делятся на области; куб, лежащий в
+    области, хранится с точностью до области. Клетки плит, кнопок, дверей и рассеивателей хранятся
+    точно. Поэтому кратчайшее решение - по числу действий (E и шагов на особые клетки), а ходьба
+    между ними строится кратчайшими путями уже по точному состоянию (см. commands)"""
+    def __init__(self, field):
+        mt = field.mt
+        net = field.signals
+        self.rows, self.cols = mt.size()
+        self.codes = bytes(mt.codes)
+        self.walk = bytes(mt.walk)
+        self.start = mt.index(*field.start_pos)
+        n = len(self.codes)
+        code = lambda i: chr(self.codes[i])
+        self.activators = {}            # Получатель -> его активаторы
+        for a, rs in net.connect.items():
+            for r in rs:
+                self.activators.setdefault(r, []).append(a)
+        self.buttons = [a for a in net.connect if code(a) == "B"]
+        self.plates = {a for a in net.connect if code(a) == "_"}
+        self.switches = [r for r in net.count if code(r) in "dDfF"]     # Связанные двери и рассеиватели
+        self.dispensers = [i for i in range(n) if code(i) == "C"]
+        self.fizzlers = {i for i in range(n) if code(i) in "Ff"}
+        self.exits = {i for i in range(n) if code(i) == "!"}
+        self.button_bit = {a: k for k, a in enumerate(self.buttons)}
+        self.switch_bit = {r: k for k, r in enumerate(self.switches)}
+        self.default = {r: code(r) in "DF" for r in self.switches}      # Закрыта / включен по умолчанию
+        self.doors = {r for r in self.switches if code(r) in "dD"}
+        self.plate_bit = {a: len(self.buttons) + k for k, a in enumerate(sorted(self.plates))}
+        groups = {}             # Маска активаторов -> получатели с таким набором активаторов
+        for r, acts in sorted(self.activators.items()):
+            mask = sum(1 << (self.button_bit[a] if a in self.button_bit else self.plate_bit[a]) for a in acts)
+            groups.setdefault(mask, []).append(r)
+        self.groups = list(groups.items())
+
+        special = self.plates | set(self.buttons) | set(self.switches) | self.fizzlers | self.exits
+        self.region = [-1] * n          # Номер области для простых клеток
+        self.region_cell = []           # Область -> её первая клетка
+        for i in range(n):
+            if self.region[i] == -1 and self.walk[i] and i not in special:
+                self.region[i] = len(self.region_cell)
+                self.region_cell.append(i)
+                stack = [i]
+                while stack:
+                    for j in self.neighbours(stack.pop()):
+                        if self.region[j] == -1 and self.walk[j] and j not in special:
+                            self.region[j] = self.region[i]
+                            stack.append(j)
+
+        self.pbits = max(1, (n - 1).bit_length())
+        self.hbits = len(self.dispensers).bit_length()
+        self.qbits = (n + len(self.region_cell)).bit_length()
+        self.buttons_init = sum(1 << k for k, a in enumerate(self.buttons) if mt.state[a])
+        self.switches_init = sum(1 << k for k, r in enumerate(self.switches) if mt.state[r])
+        self.drop_anywhere = True       # Класть куб на любую клетку или только на плиты и простой пол
+        self.components = {}
+        self.areas = {}
+
+    def __getstate__(self):     # В процессы поиска модель уходит без накопленных областей
+        return dict(self.__dict__, components={}, areas={})
+
+    def neighbours(self, i):
+        r, c = divmod(i, self.cols)
+        for dr, dc in MOVES.values():
+            if 0 <= r + dr < self.rows and 0 <= c + dc < self.cols:
+                yield (r + dr) * self.cols + c + dc
+
+    def exact(self, i):         # Положение куба на клетке i в точном состоянии
+        return i + 1
+
+    def place(self, i):         # Положение куба на клетке i в сжатом состоянии
+        return len(self.codes) + 1 + self.region[i] if self.region[i] >= 0 else i + 1
+
+    def pack(self, player, held, cubes, buttons, switches) -> int:
+        s = (switches << len(self.buttons)) | buttons
+        for q in reversed(cubes):
+            s = (s << self.qbits) | q
+        s = (s << self.hbits) | held
+        return (s << self.pbits) | player
+
+    def unpack(self, s):
+        player = s & ((1 << self.pbits) - 1)
+        s >>= self.pbits
+        held = s & ((1 << self.hbits) - 1)
+        s >>= self.hbits
+        cubes = []
+        for _ in self.dispensers:
+            cubes.append(s & ((1 << self.qbits) - 1))
+            s >>= self.qbits
+        buttons = s & ((1 << len(self.buttons)) - 1)
+        return player, held, cubes, buttons, s >> len(self.buttons)
+
+    def walkable(self, i, switches):
+        if i in self.doors:
+            return not switches >> self.switch_bit[i] & 1
+        return self.walk[i] == 1
+
+    def fizzling(self, i, switches):
+        if i in self.switch_bit:
+            return bool(switches >> self.switch_bit[i] & 1)
+        return chr(self.codes[i]) == "F"
+
+    def neutral(self, i, switches, held):
+        if not self.walkable(i, switches) or i in self.plates or i in self.exits:
+            return False
+        return not (held and i in self.fizzlers and self.fizzling(i, switches))
+
+    def component(self, i, switches, held) -> list:
+        """Нейтральные клетки, до которых можно дойти от нейтральной клетки i, ничего не меняя"""
+        key = i, switches, bool(held)
+        comp = self.components.get(key)
+        if comp is None:
+            seen = {i}
+            stack = [i]
+            while stack:
+                for j in self.neighbours(stack.pop()):
+                    if j not in seen and self.neutral(j, switches, held):
+                        seen.add(j)
+                        stack.append(j)
+            comp = sorted(seen)
+            self.components[key] = self.components[comp[0], switches, bool(held)] = comp
+        return comp
+
+    def canonical(self, i, switches, held):
+        return self.component(i, switches, held)[0] if self.neutral(i, switches, held) else i
+
+    def signals(self, player, cubes, buttons) -> int:
+        """Маска включенных активаторов: кнопки, затем плиты, на которых игрок или куб"""
+        on = buttons
+        for i in cubes:
+            if i - 1 in self.plate_bit:
+                on |= 1 << self.plate_bit[i - 1]
+        if player in self.plate_bit:
+            on |= 1 << self.plate_bit[player]
+        return on
+
+    def transition(self, player, held, cubes, buttons, switches, action, place):
+        """Игрок на клетке player выполняет команду action. place переводит клетку в положение
+        куба (точное или сжатое). None - команда ничего не меняет или игра бы на ней упала
+        (раздатчик уничтожает куб в руках игрока), а также куб нельзя положить на клетку, где уже
+        лежит куб. Иначе (игрок, в руках, кубы, кнопки, двери, пройден ли)"""
+        cubes = list(cubes)
+        delivered = self.signals(player, cubes, buttons)
+        if action in MOVES:
+            r, c = divmod(player, self.cols)
+            r, c = r + MOVES[action][0], c + MOVES[action][1]
+            if not (0 <= r < self.rows and 0 <= c < self.cols) \
+                    or not self.walkable(r * self.cols + c, switches):
+                return None
+            player = r * self.cols + c
+            if player in self.exits:
+                return player, held, cubes, buttons, switches, True
+            if held and player in self.fizzlers and self.fizzling(player, switches):
+                cubes[held - 1] = place(self.dispensers[held - 1])     # Куб уничтожен и выдан заново
+                held = 0
+        elif held:
+            if place(player) <= len(self.codes) and place(player) in cubes:
+                return None     # Два куба на одной клетке игра различает плохо (плита помнит только "лежит")
+            cubes[held - 1] = place(player)
+            held = 0
+        elif place(player) in cubes:
+            held = cubes.index(place(player)) + 1
+            cubes[held - 1] = 0
+        elif player in self.button_bit:
+            buttons ^= 1 << self.button_bit[player]
+        else:
+            return None
+        while True:             # Доставка сигналов, как в GSignalNet.flush
+            on = self.signals(player, cubes, buttons)
+            if on == delivered:
+                break
+            for mask, receivers in self.groups:
+                signal = on & mask == mask
+                if signal == (delivered & mask == mask):
+                    continue
+                for r in receivers:
+                    if r in self.switch_bit:
+                        bit = 1 << self.switch_bit[r]
+                        switches = switches | bit if self.default[r] != signal else switches & ~bit
+                    elif r in self.dispensers:
+                        d = self.dispensers.index(r)
+                        if held == d + 1:
+                            return None
+                        cubes[d] = place(r)
+            delivered = on
+        return player, held, cubes, buttons, switches, False
+
+    def initial(self):
+        cubes = [0] * len(self.dispensers)
+        return self.pack(self.canonical(self.start, self.switches_init, 0), 0, cubes,
+                         self.buttons_init, self.switches_init)
+
+    def moves(self, player, switches, held):
+        """Область игрока и действия в ней, которые не зависят от кубов: шаги на особые клетки
+        (по одному на клетку) и, если куб в руках, куда его положить (по одной клетке на положение;
+        без drop_anywhere - только на плиты и в области простого пола)"""
+        key = player, switches, bool(held), self.drop_anywhere
+        res = self.areas.get(key)
+        if res is None:
+            area = self.component(player, switches, held) if self.neutral(player, switches, held) else [player]
+            inside = set(area)
+            moves = []
+            targets = set()
+            for x in area:
+                r, c = divmod(x, self.cols)
+                for cmd, (dr, dc) in MOVES.items():
+                    y = (r + dr) * self.cols + c + dc
+                    if 0 <= r + dr < self.rows and 0 <= c + dc < self.cols \
+                            and y not in inside and y not in targets and self.walkable(y, switches):
+                        targets.add(y)
+                        moves.append((x, cmd, None))
+            if held:
+                places = set()
+                for x in area:
+                    if self.place(x) not in places \
+                            and (self.drop_anywhere or self.region[x] >= 0 or x in self.plates):
+                        places.add(self.place(x))
+                        moves.append((x, "E", None))
+            res = self.areas[key] = area, inside, moves
+        return res
+
+    def expand(self, states):
+        """Переходы из сжатых состояний: список (откуда, действие, куда, пройден ли уровень).
+        Действие - (клетка, команда, куб): дойти до клетки и выполнить команду (шаг или E)"""
+        out = []
+        for state in states:
+            player, held, cubes, buttons, switches = rest = self.unpack(state)
+            area, inside, moves = self.moves(player, switches, held)
+            if not held:
+                moves = list(moves)
+                for k, q in enumerate(cubes):   # Какой куб взять
+                    if q:
+                        x = q - 1 if q <= len(self.codes) else self.region_cell[q - len(self.codes) - 1]
+                        if x in inside and (q > len(self.codes) or cubes.index(q) == k):
+                            moves.append((x, "E", k))
+                moves.extend((b, "E", None) for b in self.buttons if b in inside and b + 1 not in cubes)
+            for x, cmd, k in moves:
+                res = self.transition(x, *rest[1:], cmd, self.place)
+                if res is None:
+                    continue
+                p, h, q, b, s, won = res
+                out.append((state, (x, cmd, k), self.pack(self.canonical(p, s, h), h, q, b, s), won))
+        return out
+
+    def commands(self, plan) -> str:
+        """Перевод плана из действий expand в команды игры. Состояние ведется точно, ходьба до
+        клетки действия - кратчайшим путем по нейтральным клеткам"""
+        player, held, cubes, buttons, switches = self.start, 0, [0] * len(self.dispensers), \
+            self.buttons_init, self.switches_init
+        out = []
+        for x, cmd, k in plan:
+            if k is not None:                   # Взять определенный куб
+                x = cubes[k] - 1
+            elif cmd == "E" and held and self.region[x] >= 0:   # Положить - на свободную клетку области
+                x = self.nearest(player, switches, held,
+                                 lambda i: self.region[i] == self.region[x] and self.exact(i) not in cubes)
+            path = self.path(player, x, switches, held) + cmd
+            for step in path:
+                res = self.transition(player, held, cubes, buttons, switches, step, self.exact)
+                assert res is not None, "plan does not replay"
+                player, held, cubes, buttons, switches, won = res
+            out.append(path)
+        return "".join(out)
+
+    def nearest(self, start, switches, held, good):
+        """Ближайшая нейтральная клетка, для которой good(клетка) истинно"""
+        return next(i for i in self.walk_order(start, switches, held) if good(i))
+
+    def walk_order(self, start, switches, held):
+        prev = {start: None}
+        queue = collections.deque([start])
+        while queue:
+            i = queue.popleft()
+            yield i
+            for j in self.neighbours(i):
+                if j not in prev and self.neutral(j, switches, held):
+                    prev[j] = i
+                    queue.append(j)
+
+    def path(self, start, goal, switches, held) -> str:
+        """Команды кратчайшего пути от start до goal по нейтральным клеткам"""
+        prev = {start: None}
+        queue = collections.deque([start])
+        while goal not in prev:
+            i = queue.popleft()
+            for j in self.neighbours(i):
+                if j not in prev and self.neutral(j, switches, held):
+                    prev[j] = i
+                    queue.append(j)
+        out = []
+        while prev[goal] is not None:
+            d = goal - prev[goal]
+            out.append({-self.cols: "U", -1: "L", self.cols: "D", 1: "R"}[d])
+            goal = prev[goal]
+        return "".join(reversed(out))
+
+
+_model = None
+
+
+def _init(model):
+    global _model
+    _model = model
+
+
+def _expand(states):
+    return _model.expand(states)
+
+
+def solve(model: GLevelModel, jobs=1, max_states=None, complete=False):
+    """Проверка уровня. Сначала ищет решение, в котором кубы кладутся только на нажимные плиты
+    и на простой пол - так состояний на порядок меньше, но на больших уровнях это все равно сотни
+    тысяч состояний и десятки секунд. Такой план кратчайший только среди решений с этим
+    ограничением. Если их нет, перебирает все состояния, чтобы доказать, что уровень не проходится.
+    С complete сразу делает полный перебор: тогда решение кратчайшее среди всех, но перебор
+    намного дольше и на уровнях 3-4 может занять много минут (ограничивается max_states).
+    Возвращает (план или None, число состояний, исчерпан ли поиск)"""
+    states = 0
+    if not complete:
+        model.drop_anywhere = False
+        plan, states, exhausted = search(model, jobs, max_states)
+        if plan is not None or not exhausted:
+            return plan, states, exhausted
+    model.drop_anywhere = True
+    plan, more, exhausted = search(model, jobs, max_states)
+    return plan, states + more, exhausted
+
+
+def search(model: GLevelModel, jobs=1, max_states=None):
+    """Поиск в ширину по сжатым состояниям. Возвращает (план или None, число состояний, исчерпан ли
+    поиск). Если поиск прерван по max_states, отсутствие плана ничего не доказывает. Большой фронт
+    делится на части и раскрывается в jobs процессах, повторы отсеиваются здесь же"""
+    start = model.initial()
+    parent = {start: None}      # Состояние -> (предыдущее, действие)
+    frontier = [start]
+    pool = None
+    if jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init, initargs=(model,))
+    try:
+        while frontier:
+            if pool is not None and len(frontier) >= PARALLEL_FRONTIER:
+                parts = [frontier[i:i + CHUNK] for i in range(0, len(frontier), CHUNK)]
+                moves = [m for part in pool.map(_expand, parts) for m in part]
+            else:
+                moves = model.expand(frontier)
+            frontier = []
+            for state, action, nxt, won in moves:
+                if won:
+                    plan = [action]
+                    while parent[state] is not None:
+                        state, action = parent[state]
+                        plan.append(action)
+                    return plan[::-1], len(parent), True
+                if nxt not in parent:
+                    parent[nxt] = (state, action)
+                    frontier.append(nxt)
+            if max_states is not None and len(parent) > max_states:
+                return None, len(parent), False
+        return None, len(parent), True
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def load(folder) -> GLevelModel:
+    """Строит уровень так же, как игра (без окна), и снимает с него модель"""
+    if not main.IMG:
+        main.load_data()
+    main.level_main = ex = main.GLevelExec(None, folder, script="")
+    try:
+        ex.start()
+        return GLevelModel(ex.field)
+    finally:
+        main.level_main = None
+
+
+def main_(*args):
+    jobs = os.cpu_count() or 1
+    max_states = None
+    verify = "--no-verify" not in args
+    complete = "--complete" in args
+    if "--jobs" in args:
+        jobs = int(args[args.index("--jobs") + 1])
+    if "--max-states" in args:
+        max_states = int(args[args.index("--max-states") + 1])
+    folders = [a for a in args[1:] if os.path.isdir(a)]
+    if not folders:
+        root = os.path.join("data", "lvls")
+        folders = [os.path.join(root, name) for name in sorted(os.listdir(root))]
+    main.log = lambda *a, **k: None
+    failed = 0
+    for folder in folders:
+        t = time.perf_counter()
+        model = load(folder)
+        plan, states, exhausted = solve(model, jobs, max_states, complete)
+        took = time.perf_counter() - t
+        if plan is not None:
+            script = model.commands(plan)
+            line = "solvable in {} actions, {} commands: {}".format(len(plan), len(script), script)
+            if verify:
+                code, _ = main.simulate(folder, script)
+                line += " (verified)" if code == -1000 else " (NOT confirmed by simulate: {})".format(code)
+                failed += code != -1000
+        elif exhausted:
+            line = "UNSOLVABLE"
+            failed += 1
+        else:
+            line = "unknown, state limit reached"
+        print("{}: {} [{} states, {:.2f}s]".format(folder, line, states, took))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_(*sys.argv))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main     # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def game(monkeypatch):
+    """Игра без окна: изображения загружены, пути считаются от корня проекта"""
+    monkeypatch.chdir(ROOT)
+    if not main.IMG:
+        main.load_data()
+    yield main
+    main.level_main = None
+
+
+@pytest.fixture
+def run_level():
+    """Прохождение уровня без окна по командам. Машина уровня остается доступной после выхода"""
+    def run(level_folder, script, **kwargs):
+        machine = main.level_main = main.GLevelExec(None, level_folder, script=script, **kwargs)
+        machine.main()
+        return machine
+    return run
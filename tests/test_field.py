@@ -0,0 +1,76 @@
+import main
+from test_signals import build
+
+
+def test_plain_cells_have_no_objects():
+    field = build(["* B", "  D"], {"0,2": ["1,2"]})
+    mt = field.mt
+    assert mt.peek(0, 0) is None and mt.peek(0, 1) is None
+    assert not mt.walkable(0, 0) and mt.walkable(0, 1)
+    assert isinstance(mt.peek(0, 2), main.EButtonCell)
+    assert mt.index(0, 2) in mt.indices()
+
+
+def test_materialize_restores_state_from_bits():
+    field = build(["B D"], {"0,0": ["0,2"]})
+    mt = field.mt
+    door = mt.index(0, 2)
+    mt.cell(door)
+    assert mt.demote(door)
+    assert door not in mt.indices()
+    mt.cell(mt.index(0, 0)).on_activation()
+    field.signals.flush()           # Получатель создается заново и открывается
+    cell = mt.cell(door)
+    assert not cell.state and cell.params["walkable"]
+    assert mt.demote(door)
+    assert mt.state[door] == 0 and mt.walk[door] == 1
+    again = mt.cell(door)
+    assert again is not cell
+    assert not again.state and again.params["walkable"]
+    assert again.image is main.TEXTURES.get("door_open")
+    assert again.field_pos.pos() == (0, 2)
+    assert again.rect.topleft == field.place((0, 2))
+
+
+def test_demote_keeps_cells_with_temporary_state():
+    field = build(["_ I"], {})
+    mt = field.mt
+    plate = mt.cell(0)
+    plate.on_stand()
+    assert not mt.demote(0)         # Игрок стоит - состояние не только в битах
+    plate.on_leave()
+    assert mt.demote(0)
+    info = mt.cell(2)
+    info.params["takeables"].append(object())
+    assert not mt.demote(2)
+
+
+def test_info_text_survives_demote():
+    meta = '{"name": "t", "start_pos": "0,0", "connections": {}, "info_text": {"0,1": "hello"}}'
+    field = main.GLevel.Build(main.GLevelData.Parse(" I", meta))
+    assert field.mt.cell(1).text == "hello"
+    assert field.mt.demote(1)
+    assert field.mt.cell(1).text == "hello"
+
+
+def test_activate_keeps_objects_near_player(monkeypatch):
+    monkeypatch.setattr(main, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(main, "ACTIVE_CHUNKS", 0)
+    field = build(["B  B  B", "D     D"], {"0,0": ["1,0"], "0,6": ["1,6"]})
+    mt = field.mt
+    field.activate(0, 0)
+    assert set(mt.indices()) == {mt.index(0, 0), mt.index(1, 0)}
+    field.activate(0, 6)
+    assert set(mt.indices()) == {mt.index(0, 6), mt.index(1, 6)}
+    assert set(field.chunks) <= {(0, 3)}
+
+
+def test_reset_drops_objects_and_writes_bits():
+    field = build(["B D"], {"0,0": ["0,2"]})
+    mt = field.mt
+    walk, state = bytes(mt.walk), bytes(mt.state)
+    mt.cell(0).on_activation()
+    field.signals.flush()
+    field.reset(walk, state)
+    assert not list(mt.indices())
+    assert mt.cell(2).state and not mt.walkable(0, 2)
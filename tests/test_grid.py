@@ -0,0 +1,40 @@
+import main
+
+DEMO = "data/lvls/demo"
+DISPENSER = (2, 5)
+
+
+def check_index(group):
+    for spr in group:
+        assert sorted(group.keys[spr]) == sorted(group.cells(spr.rect))
+        for key in group.keys[spr]:
+            assert spr in group.grid[key]
+    assert sum(len(bucket) for bucket in group.grid.values()) == sum(len(keys) for keys in group.keys.values())
+
+
+def test_query_and_reindex():
+    group = main.GGridGroup(size=100)
+    a = main.GSprite([10, 10, 20, 20])
+    b = main.GSprite([190, 10, 20, 20])     # Лежит в двух ячейках
+    group.add(a, b)
+    assert group.keys[b] == [(1, 0), (2, 0)]
+    assert group.query(main.pg.Rect(0, 0, 100, 100)) == [a]
+    assert group.query(main.pg.Rect(205, 15, 10, 10)) == [b]
+    b.stand(500, 500)
+    group.reindex(b)
+    check_index(group)
+    assert group.query(main.pg.Rect(150, 0, 100, 100)) == []
+
+
+def test_respawned_cube_on_straddling_cell_stays_indexed(run_level):
+    level = run_level(DEMO, "")
+    cell = level.field.mt[DISPENSER]
+    # Граница ячейки сетки проходит через середину клетки раздатчика
+    level.takeable_group = group = main.GGridGroup(size=cell.rect.x + main.CELL_SIZE // 2)
+    assert len({x // group.size for x in (cell.rect.left, cell.rect.right - 1)}) == 2
+    cell.on_positive()
+    for _ in range(300):
+        cell.on_positive()                  # Живой куб: die() -> выдача заново -> еще одна выдача
+        check_index(group)
+    cube = cell.item
+    assert group.query(cube.rect) == [cube]
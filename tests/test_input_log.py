@@ -0,0 +1,121 @@
+import os
+
+import main
+from test_simulate import DEMO, DEMO_SOLUTION
+from test_snapshot import fields
+
+
+def script_log(script, every=6):
+    """Запись, в которой команды script приходят раз в every шагов"""
+    seed = main.zlib.crc32(DEMO.encode("utf-8"))
+    log = main.GInputLog(DEMO, seed, main.GPygameMachine.sim_rate)
+    for i, cmd in enumerate(script):
+        log.append(i * every, cmd)
+    log.end = len(script) * every
+    return log
+
+
+def play(rec, record=None):
+    level = main.level_main = main.GLevelExec(None, rec.level, replay=rec, record=record)
+    code = level.main()
+    return level, code
+
+
+def test_dump_read_round_trip():
+    log = script_log("RRE")
+    log.append(30, "p")
+    again = main.GInputLog.Read(log.dump())
+    assert (again.level, again.seed, again.sim_rate, again.end) == (log.level, log.seed, log.sim_rate, log.end)
+    assert list(again.ticks) == list(log.ticks) and again.codes == log.codes
+    assert main.GInputLog.Read(b"nope") is None
+
+
+def test_replay_wins_demo():
+    level, code = play(script_log(DEMO_SOLUTION))
+    assert code == -1000
+
+
+def test_record_then_replay_is_identical(tmp_path):
+    first, code = play(script_log("RRREULUUURE"), record=str(tmp_path))
+    path, = [os.path.join(tmp_path, name) for name in os.listdir(tmp_path)]
+    rec = main.GInputLog.Load(path)
+    assert len(rec) == 11 and rec.end == first.g_cycle
+    second, again = play(rec)
+    assert again == code
+    assert second.g_cycle == first.g_cycle
+    assert fields(second.snapshot()) == fields(first.snapshot())
+    assert [c.rect.topleft for c in second.takeable_group] == [c.rect.topleft for c in first.takeable_group]
+
+
+def test_pause_restart_is_replayed():
+    log = script_log("RRRE")
+    log.append(30, main.GInputLog.PAUSE[1000])     # Перезапуск из паузы
+    log.end = 40
+    level, code = play(log)
+    assert code == 0
+    assert level.player.field_pos.pos() == level.field.start_pos
+
+
+class ScriptedPause:
+    """Пауза, сразу возвращающая заданные выборы"""
+    def __init__(self, choices):
+        self.choices = list(choices)
+
+    def main(self):
+        return self.choices.pop(0)
+
+
+class LiveLevel(main.GLevelExec):
+    """Игра с окном, где события каждого кадра берутся из frames (списки клавиш)"""
+    def __init__(self, screen, frames, pause, record):
+        super().__init__(screen, DEMO, record=record)
+        self.frames = list(frames)
+        self.pause = ScriptedPause(pause)
+
+    def handle_input(self):
+        keys = self.frames.pop(0) if self.frames else []
+        self.events = [main.pg.event.Event(main.pg.KEYDOWN, key=key) for key in keys]
+        main.time.sleep(1 / self.sim_rate)
+        super().handle_input()
+
+
+def test_live_recording_replays_identically(tmp_path):
+    pg = main.pg
+    screen = pg.display.set_mode(main.SCREEN_SIZE)
+    try:
+        keys = {"U": pg.K_UP, "L": pg.K_LEFT, "D": pg.K_DOWN, "R": pg.K_RIGHT, "E": pg.K_e, "P": pg.K_ESCAPE}
+
+        def frames_of(*groups):         # Группа клавиш - один кадр, между группами ходьба успевает закончиться
+            return [f for g in groups for f in [[keys[k] for k in g]] + [[]] * 10]
+        # С кубом в руках: E (кладет куб - тратит RNG) и перезапуск в одном кадре, затем снова выдача куба
+        frames = frames_of(*"RRREULUUURE", "EP", *"RRRE", "P")
+        pause = [1000, -2000]
+        level = main.level_main = LiveLevel(screen, frames, pause, str(tmp_path))
+        assert level.main() == -2000
+    finally:
+        pg.display.quit()
+    path, = [os.path.join(tmp_path, name) for name in os.listdir(tmp_path)]
+    rec = main.GInputLog.Load(path)
+    assert "x" in rec.codes.decode() and "r" in rec.codes.decode()
+    again, code = play(rec)
+    assert code == -2000
+    assert fields(again.final) == fields(level.final)
+    assert len(level.takeable_group) == 1
+    assert [c.rect for c in again.takeable_group] == [c.rect for c in level.takeable_group]
+
+
+def test_quit_inside_command_is_logged(run_level, tmp_path):
+    level = run_level(DEMO, "", record=str(tmp_path))
+    level.exit_code = -1
+
+    def popup_closed(cmd):              # Как InfoCell, всплывающий текст которого закрыли вместе с окном
+        level.exit_code = 1
+
+    level.command = popup_closed
+    level.commands.append("E")
+    level.run_commands()
+    assert level.input_log.event(len(level.input_log) - 1) == main.GInputLog.QUIT
+    rec = main.GInputLog.Read(level.input_log.dump())
+    rec.end = 1
+    _, code = play(rec)
+    assert code == 1
@@ -0,0 +1,123 @@
+import os
+import shutil
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def level(tmp_path, monkeypatch):
+    """Копия демо-уровня без compiled.bin и счетчик разборов исходников"""
+    folder = str(tmp_path / "demo")
+    shutil.copytree("data/lvls/demo", folder, ignore=shutil.ignore_patterns(main.LEVEL_CACHE))
+    parsed = []
+    parse = main.GLevelData.Parse.__func__
+    monkeypatch.setattr(main.GLevelData, "Parse",
+                        classmethod(lambda cls, *a: parsed.append(1) or parse(cls, *a)))
+    monkeypatch.setattr(main.GLevel, "compiled", {})
+    return folder, parsed
+
+
+def compile_cold(folder):       # Без кеша в памяти: только файл
+    main.GLevel.compiled.clear()
+    return main.GLevel.Compile(folder)
+
+
+def touch(path, ns):
+    os.utime(path, ns=(ns, ns))
+
+
+def test_first_compile_writes_cache(level):
+    folder, parsed = level
+    data = main.GLevel.Compile(folder)
+    assert len(parsed) == 1
+    assert os.path.exists(os.path.join(folder, main.LEVEL_CACHE))
+    assert main.GLevel.Compile(folder) is data      # Из памяти
+    again = compile_cold(folder)
+    assert len(parsed) == 1                         # Из файла
+    assert (again.codes, again.connections, again.info_text, again.start_pos, again.digest) == \
+        (data.codes, data.connections, data.info_text, data.start_pos, data.digest)
+
+
+def test_mtime_change_with_same_content_uses_digest(level):
+    folder, parsed = level
+    main.GLevel.Compile(folder)
+    map_file = os.path.join(folder, "map.txt")
+    touch(map_file, os.stat(map_file).st_mtime_ns + 10 ** 9)
+    data = compile_cold(folder)
+    assert len(parsed) == 1                         # Хеш тот же - не разбирается
+    assert data.stamp[0] == os.stat(map_file).st_mtime_ns
+    compile_cold(folder)
+    assert len(parsed) == 1
+
+
+def test_content_change_recompiles(level):
+    folder, parsed = level
+    old = main.GLevel.Compile(folder)
+    map_file = os.path.join(folder, "map.txt")
+    with open(map_file) as f:
+        text = f.read()
+    with open(map_file, "w") as f:
+        f.write(text.replace("B", " ", 1))
+    touch(map_file, os.stat(map_file).st_mtime_ns + 10 ** 9)
+    data = main.GLevel.Compile(folder)
+    assert len(parsed) == 2
+    assert data.digest != old.digest
+    assert data.codes.count(b"B") == old.codes.count(b"B") - 1
+
+
+def test_other_version_is_ignored(level, monkeypatch):
+    folder, parsed = level
+    main.GLevel.Compile(folder)
+    monkeypatch.setattr(main, "LEVEL_CACHE_VERSION", main.LEVEL_CACHE_VERSION + 1)
+    compile_cold(folder)
+    assert len(parsed) == 2
+
+
+def test_broken_cache_is_ignored(level):
+    folder, parsed = level
+    main.GLevel.Compile(folder)
+    with open(os.path.join(folder, main.LEVEL_CACHE), "r+b") as f:
+        f.truncate(main.GLevelData.HEADER.size + 3)
+    data = compile_cold(folder)
+    assert len(parsed) == 2
+    assert data.name == "demo"
+
+
+def read_or_none(raw):          # Так же, как Compile: ошибка разбора - нет кеша
+    try:
+        return main.GLevelData.Read(raw)
+    except (main.struct.error, UnicodeDecodeError):
+        return None
+
+
+def reseal(raw):                # Подгоняет длину и crc заголовка под испорченные данные
+    header = list(main.GLevelData.HEADER.unpack_from(raw))
+    payload = raw[main.GLevelData.HEADER.size:]
+    header[-2:] = len(payload), main.zlib.crc32(payload)
+    return main.GLevelData.HEADER.pack(*header) + payload
+
+
+def test_truncated_cache_is_rejected(level):
+    folder, _ = level
+    raw = main.GLevel.Compile(folder).dump()
+    assert main.GLevelData.Read(raw) is not None
+    text = "Thanks for playing demo".encode("utf-8")
+    assert raw.endswith(text)
+    for cut in range(main.GLevelData.HEADER.size, len(raw)):
+        assert read_or_none(raw[:cut]) is None                  # Обрезан, в том числе внутри текстов
+        assert read_or_none(reseal(raw[:cut])) is None          # Даже с подходящими длиной и crc
+    assert read_or_none(reseal(raw + b"\0")) is None            # Лишние байты в конце
+
+
+def test_corrupted_cache_is_rejected(level):
+    folder, parsed = level
+    main.GLevel.Compile(folder)
+    path = os.path.join(folder, main.LEVEL_CACHE)
+    with open(path, "r+b") as f:
+        f.seek(-3, os.SEEK_END)
+        f.write(b"XYZ")
+    data = compile_cold(folder)
+    assert len(parsed) == 2
+    assert data.info_text[0][2] == "Thanks for playing demo"
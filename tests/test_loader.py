@@ -0,0 +1,32 @@
+import pytest
+
+import main
+
+DEMO = "data/lvls/demo"
+
+
+def test_loader_prepares_data_without_textures(monkeypatch):
+    monkeypatch.setattr(main, "TEXTURES", main.GTextureCache())
+    loader = main.GLevelLoader()
+    try:
+        loader.preload(DEMO)
+        data = loader.get(DEMO)
+    finally:
+        loader.shutdown()
+    assert data.links is not None and data.info is not None
+    assert not main.TEXTURES.items          # Изображения готовятся только в главном потоке
+
+
+def test_level_uses_handed_over_data(monkeypatch):
+    data = main.GLevel.Compile(DEMO).prepare()
+
+    def compile_(*_):
+        raise AssertionError("level compiled again")
+
+    monkeypatch.setattr(main.GLevel, "Compile", staticmethod(compile_))
+    level = main.level_main = main.GLevelExec(None, DEMO, script="RR")
+    level.data = data
+    assert level.main() == 0
+    assert level.digest == data.digest and level.data is None
+    with pytest.raises(AssertionError):
+        level.main()                        # Без переданных данных уровень собирается сам
@@ -0,0 +1,16 @@
+DEMO = "data/lvls/demo"
+
+
+def test_held_cube_follows_player(run_level):
+    level = run_level(DEMO, "RRREULUUUREULLL")
+    assert level.player.hold is not None
+    assert level.player.hold.center() == level.player.center()
+
+
+def test_release_drops_cube_on_player_cell(run_level):
+    level = run_level(DEMO, "RRREULUUUREULLLE")
+    assert level.player.hold is None
+    cell = level.field.mt[level.player.field_pos]
+    cube, = cell.params["takeables"]
+    assert cell.rect.contains(cube.rect)
+    assert cube in level.takeable_group
@@ -0,0 +1,38 @@
+import main
+from test_signals import build
+
+
+def test_pool_limit():
+    pool = main.GPool(limit=2)
+    assert pool.get() is None
+    assert pool.put(1) and pool.put(2) and not pool.put(3)
+    assert len(pool) == 2 and pool.get() == 2
+
+
+def test_build_does_not_leak_pooled_cubes(monkeypatch):
+    monkeypatch.setattr(main.Takeable, "pools", {})
+    for _ in range(3):
+        main.Cube().recycle()
+    pool = main.Takeable.pools[main.Cube]
+    for _ in range(5):
+        build(["C  "], {})
+    assert len(pool) == 3
+
+
+def test_dispenser_cube_returns_to_pool_on_demote(monkeypatch):
+    monkeypatch.setattr(main.Takeable, "pools", {})
+    field = build(["C  "], {})
+    cell = field.mt.cell(0)
+    cube = cell.item
+    assert not cube.alive()
+    assert field.mt.demote(0)
+    assert main.Takeable.pools[main.Cube].get() is cube
+    assert "on_death" not in cube.__dict__      # Обработчик раздатчика снят
+
+
+def test_recycled_cube_has_own_image(monkeypatch):
+    monkeypatch.setattr(main.Takeable, "pools", {})
+    a, b = main.Cube(), main.Cube()
+    assert a.image is not b.image and a.image is not main.IMG["cube"]
+    a.recycle()
+    assert main.Cube.Get() is a and a.pooled is False
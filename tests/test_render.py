@@ -0,0 +1,18 @@
+import main
+
+DEMO = "data/lvls/demo"
+
+
+def test_window_events_force_full_redraw(run_level):
+    level = run_level(DEMO, "")
+    level.headless = False
+    for kind in main.REDRAW_EVENTS:
+        level.full_redraw = False
+        level.events = [main.pg.event.Event(kind)]
+        level.handle_input()
+        assert level.full_redraw
+    level.full_redraw = False
+    level.events = [main.pg.event.Event(main.pg.KEYDOWN, key=main.pg.K_a)]
+    level.handle_input()
+    assert not level.full_redraw
+    assert set(main.REDRAW_EVENTS) <= set(main.INPUT_EVENTS)
@@ -0,0 +1,76 @@
+import os
+
+import main
+from test_simulate import DEMO_SOLUTION
+from test_snapshot import BUTTON, DEMO, DOOR, fields
+
+
+def test_round_trip_with_snapshot(run_level):
+    level = run_level(DEMO, "RRREULUUUREULLL")
+    save = main.GSave(2, DEMO, level.digest, level.snapshot())
+    again = main.GSave.Read(save.dump())
+    assert (again.lvl, again.level, again.digest) == (2, DEMO, level.digest)
+    assert fields(again.snap) == fields(save.snap)
+    assert again.fits(DEMO, level.digest)
+    assert not again.fits("data/lvls/1", level.digest)
+    assert not again.fits(DEMO, bytes(16))
+
+
+def test_round_trip_without_snapshot():
+    again = main.GSave.Read(main.GSave(3).dump())
+    assert (again.lvl, again.level, again.snap) == (3, None, None)
+    assert main.GSave.Read(b"TRSV") is None
+
+
+def test_final_save_delivers_pending_signals(run_level):
+    level = run_level(DEMO, "RRR")
+    level.command("E")                  # Команда из буфера, сигнал не доставлен
+    level.quit()
+    save = main.GSave.Read(main.GSave(0, DEMO, level.digest, level.final).dump())
+    resumed = main.level_main = main.GLevelExec(None, DEMO, script="")
+    resumed.resume = save
+    resumed.main()
+    mt = resumed.field.mt
+    assert resumed.player.field_pos.pos() == BUTTON
+    assert mt.cell(mt.index(*BUTTON)).state
+    assert mt.walkable(*DOOR)
+
+
+def test_no_final_snapshot_after_win(run_level):
+    assert run_level(DEMO, DEMO_SOLUTION).final is None
+
+
+def test_load_falls_back_to_legacy_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SAVE_FILE", str(tmp_path / "save.bin"))
+    monkeypatch.setattr(main, "LEGACY_SAVE_FILE", str(tmp_path / "save.ini"))
+    assert main.GSave.Load().lvl == 0
+    (tmp_path / "save.ini").write_text("2")
+    assert main.GSave.Load().lvl == 2
+    (tmp_path / "save.bin").write_bytes(b"TRSV\x01\x00broken")
+    assert main.GSave.Load().lvl == 2
+
+
+def test_writer_replaces_file_atomically(tmp_path):
+    path = str(tmp_path / "save.bin")
+    writer = main.GSaveWriter()
+    writer.write(path, main.GSave(1).dump)
+    writer.write(path, main.GSave(2).dump)
+    writer.shutdown()
+    with open(path, "rb") as f:
+        assert main.GSave.Read(f.read()).lvl == 2
+    assert os.listdir(tmp_path) == ["save.bin"]
+
+
+def test_writer_logs_serialisation_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGGER", main.GLogger(echo=main.ERROR + 1))
+    path = str(tmp_path / "save.bin")
+
+    def broken():
+        return main.struct.pack("<H", -1)
+
+    writer = main.GSaveWriter()
+    writer.write(path, broken)
+    writer.shutdown()
+    errors = [r for r in main.LOGGER.records if r[1] == main.ERROR]
+    assert len(errors) == 1 and "struct.error" in errors[0][4]
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,63 @@
+import main
+
+
+def test_fifo_order_and_next_frame():
+    q = main.GScheduler()
+    out = []
+    q.schedule(lambda: out.append(1))
+    q.schedule(lambda: (out.append(2), q.schedule(lambda: out.append(4))))
+    q.schedule(lambda: out.append(3))
+    q.run()
+    assert out == [1, 2, 3]         # Добавленная во время кадра задача ждет следующего
+    q.run()
+    assert out == [1, 2, 3, 4]
+    assert len(q) == 0
+
+
+def test_delay():
+    q = main.GScheduler()
+    out = []
+    q.schedule(lambda: out.append("b"), delay=2)
+    q.schedule(lambda: out.append("c"), delay=2)
+    q.schedule(lambda: out.append("a"), delay=1)
+    q.schedule(lambda: out.append("now"))
+    frames = []
+    for _ in range(4):
+        q.run()
+        frames.append(list(out))
+    # delay - на столько кадров позже задачи без задержки
+    assert frames == [["now"], ["now", "a"], ["now", "a", "b", "c"], ["now", "a", "b", "c"]]
+
+
+def test_budget_carries_tasks_over():
+    q = main.GScheduler(budget=-1)  # Бюджет всегда исчерпан: одна задача за кадр
+    out = []
+    for i in range(3):
+        q.schedule(lambda i=i: out.append(i))
+    q.run()
+    assert out == [0]
+    assert len(q) == 2
+    q.run()
+    q.run()
+    assert out == [0, 1, 2]
+
+
+def test_cancel():
+    q = main.GScheduler()
+    out = []
+    task = q.schedule(lambda: out.append("x"))
+    delayed = q.schedule(lambda: out.append("y"), delay=1)
+    q.schedule(lambda: out.append("z"))
+    q.cancel(task)
+    delayed.cancel()
+    for _ in range(3):
+        q.run()
+    assert out == ["z"]
+
+
+def test_clear():
+    q = main.GScheduler()
+    q.schedule(lambda: None)
+    q.schedule(lambda: None, delay=5)
+    q.clear()
+    assert len(q) == 0
@@ -0,0 +1,76 @@
+import pytest
+
+import main
+
+
+def build(rows, connections):
+    """Поле из строк карты и связей {"r,c": ["r,c", ...]}"""
+    meta = '{{"name": "t", "start_pos": "0,0", "connections": {}, "info_text": {{}}}}'.format(
+        str(connections).replace("'", '"'))
+    return main.GLevel.Build(main.GLevelData.Parse("\n".join(rows), meta))
+
+
+def test_signal_waits_for_flush():
+    field = build(["B D"], {"0,0": ["0,2"]})
+    button, door = field.mt[0, 0], field.mt[0, 2]
+    assert door.state and not field.mt.walkable(0, 2)
+    button.on_activation()
+    assert door.state                   # Доставляется только во flush
+    field.signals.flush()
+    assert not door.state and field.mt.walkable(0, 2)
+    button.on_activation()
+    field.signals.flush()
+    assert door.state
+
+
+def test_receiver_needs_all_activators():
+    field = build(["BBD"], {"0,0": ["0,2"], "0,1": ["0,2"]})
+    a, b, door = field.mt[0, 0], field.mt[0, 1], field.mt[0, 2]
+    a.on_activation()
+    field.signals.flush()
+    assert door.state
+    b.on_activation()
+    field.signals.flush()
+    assert not door.state
+
+
+def test_toggle_within_frame_is_not_delivered():
+    field = build(["B D"], {"0,0": ["0,2"]})
+    button, door = field.mt[0, 0], field.mt[0, 2]
+    calls = []
+    door.on_positive = lambda: calls.append("+")
+    door.on_negative = lambda: calls.append("-")
+    button.on_activation()
+    button.on_activation()
+    field.signals.flush()
+    assert calls == []
+    assert not field.signals.pending
+
+
+def test_chained_signal_is_delivered_in_same_flush():
+    field = build(["B__D"], {"0,0": ["0,1"], "0,2": ["0,3"]})
+    first, plate = field.mt[0, 1], field.mt[0, 2]
+    first.on_positive = lambda: (setattr(plate, "standing", True), plate.check())
+    field.mt[0, 0].on_activation()
+    field.signals.flush()
+    assert not field.mt[0, 3].state
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(Exception, match="Cyclic cell connections"):
+        build(["__D"], {"0,0": ["0,1"], "0,1": ["0,0"]})
+
+
+def test_pressure_button_image_changes_only_with_state():
+    field = build(["_ D"], {"0,0": ["0,2"]})
+    plate = field.mt[0, 0]
+    field.changed.clear()
+    plate.on_stand()
+    plate.on_cube_set()
+    assert field.changed == [plate]
+    plate.on_leave()
+    assert field.changed == [plate]
+    plate.on_cube_take()
+    assert field.changed == [plate, plate]
+    field.signals.flush()
+    assert field.mt[0, 2].state
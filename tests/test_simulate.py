@@ -0,0 +1,28 @@
+import main
+
+DEMO = "data/lvls/demo"
+DEMO_SOLUTION = "RRREULUUUREULLLDEURDRRRRRRRRELLLLLULLLLDEURDDDDDRRRRRURRRDEURDRRURD"
+
+
+def test_simulate_wins_demo():
+    code, ticks = main.simulate(DEMO, DEMO_SOLUTION)
+    assert code == -1000
+    assert ticks > 0
+    assert main.level_main is None
+
+
+def test_simulate_stops_when_script_ends():
+    code, _ = main.simulate(DEMO, "RR")
+    assert code == 0
+
+
+def test_simulate_max_ticks():
+    code, ticks = main.simulate(DEMO, "." * 1000, max_ticks=10)
+    assert code == 0
+    assert ticks <= 11
+
+
+def test_simulate_every_level_builds():
+    for name in ("1", "2", "3", "4", "demo"):
+        code, _ = main.simulate("data/lvls/" + name, "")
+        assert code == 0
@@ -0,0 +1,49 @@
+import main
+
+DEMO = "data/lvls/demo"
+DOOR, BUTTON = (4, 3), (6, 5)       # Кнопка демо-уровня открывает двери 4,3 и 4,4 и выдает куб
+
+
+def fields(snap):
+    return (snap.walk, snap.state, snap.signals, snap.lying, snap.player, snap.cubes, snap.held)
+
+
+def test_dump_read_round_trip(run_level):
+    level = run_level(DEMO, "RRREULUUUREULLL")
+    snap = level.snapshot()
+    assert snap.held != -1
+    assert fields(main.GLevelSnapshot.Read(snap.dump())) == fields(snap)
+
+
+def test_restore_gives_same_snapshot(run_level):
+    level = run_level(DEMO, "RRREULUUURE")
+    snap = level.snapshot()
+    other = run_level(DEMO, "")
+    other.restore(snap)
+    assert fields(other.snapshot()) == fields(snap)
+    assert other.player.field_pos.pos() == level.player.field_pos.pos()
+
+
+def test_pending_signals_are_delivered_before_snapshot(run_level):
+    level = run_level(DEMO, "RRR")
+    assert level.player.field_pos.pos() == BUTTON
+    level.command("E")
+    assert level.field.signals.pending      # Кнопка нажата, двери еще не знают
+    snap = level.snapshot()
+    assert not level.field.signals.pending
+    other = run_level(DEMO, "")
+    other.restore(main.GLevelSnapshot.Read(snap.dump()))
+    mt = other.field.mt
+    assert mt.cell(mt.index(*BUTTON)).state
+    assert mt.walkable(*DOOR) and not mt.cell(mt.index(*DOOR)).state
+
+
+def test_autosave_sees_delivered_signals(run_level, monkeypatch):
+    monkeypatch.setattr(main, "AUTOSAVE_TIME", 1 / 60)
+    seen = []
+
+    def autosave(snap):
+        seen.append(not main.level_main.field.signals.pending)
+
+    run_level(DEMO, "RRREULUUUREULLL", autosave=autosave)
+    assert seen and all(seen)
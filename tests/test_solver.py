@@ -0,0 +1,23 @@
+import main
+import solver
+
+
+def test_demo_plan_wins():
+    model = solver.load("data/lvls/demo")
+    plan, states, exhausted = solver.solve(model)
+    assert plan is not None and exhausted
+    code, _ = main.simulate("data/lvls/demo", model.commands(plan))
+    assert code == -1000
+
+
+def test_complete_plan_is_not_longer():
+    model = solver.load("data/lvls/demo")
+    plan, _, _ = solver.solve(model)
+    full, _, exhausted = solver.solve(model, complete=True)
+    assert exhausted and len(full) <= len(plan)
+
+
+def test_state_limit_is_not_a_proof():
+    model = solver.load("data/lvls/3")
+    plan, states, exhausted = solver.solve(model, max_states=100)
+    assert plan is None and not exhausted and states > 100